@@ -0,0 +1,140 @@
+"""Micro-benchmarks for the per-request overhead added by the projects API.
+
+These run locally without AWS access:
+
+    python benchmarks.py
+
+Each benchmark prints the mean time per call.
+"""
+
+import copy
+import decimal
+import json
+import os
+import timeit
+
+from validation import ValidationError, validate_body
+
+
+# A project with the same shape as the example in the README.
+EXAMPLE_PROJECT = {
+    "user_id": "google-oauth2|xxxxxxxxxxxxxxxxxxxxx",
+    "project_name": "Trifid SRO Filters",
+    "created_at": "2022-04-26T00:56:09Z",
+    "project_note": "SRO filters",
+    "project_sites": ["sro"],
+    "scheduled_with_events": [],
+    "project_constraints": {
+        "meridian_flip": "flip_ok",
+        "project_is_active": False,
+        "max_airmass": 2,
+        "lunar_dist_min": 30,
+    },
+    "project_targets": [{"name": "M 20", "dec": "-22.9717", "ra": "18.0450"}],
+    "exposures": [
+        {"area": "FULL", "filter": "PL", "exposure": "15", "bin": "1, 1", "count": "3"},
+        {"area": "FULL", "filter": "HA", "exposure": "120", "bin": "1, 1", "count": "30"},
+    ],
+    "remaining": ["3", "30"],
+    "project_data": [[], []],
+}
+
+EXAMPLE_BODIES = {
+    "new_project": EXAMPLE_PROJECT,
+    "modify_project": {
+        "project_name": EXAMPLE_PROJECT["project_name"],
+        "created_at": EXAMPLE_PROJECT["created_at"],
+        "project_changes": dict(EXAMPLE_PROJECT, project_priority="standard"),
+    },
+    "get_project": {
+        "project_name": EXAMPLE_PROJECT["project_name"],
+        "created_at": EXAMPLE_PROJECT["created_at"],
+    },
+    "add_project_data": {
+        "project_name": EXAMPLE_PROJECT["project_name"],
+        "created_at": EXAMPLE_PROJECT["created_at"],
+        "exposure_index": 1,
+        "base_filename": "sro-kb001ms-20220426-00001234",
+    },
+    "add_project_event": {
+        "project_name": EXAMPLE_PROJECT["project_name"],
+        "created_at": EXAMPLE_PROJECT["created_at"],
+        "event_id": "f83y1313-23f8-xxxx-zzzz-yy1351b7a711",
+    },
+}
+
+
+def _report(name, seconds, number):
+    print(f"{name:<40} {seconds / number * 1e6:8.2f} us/call")
+
+
+def bench_validation(number=20000):
+    """Times schema validation of a typical body for each endpoint."""
+
+    print("Request validation")
+    for schema_name, body in EXAMPLE_BODIES.items():
+        validate_body(schema_name, body)
+        seconds = timeit.timeit(lambda: validate_body(schema_name, body), number=number)
+        _report(schema_name, seconds, number)
+
+    # Rejections should be at least as cheap as acceptances.
+    bad_body = copy.deepcopy(EXAMPLE_BODIES["add_project_data"])
+    bad_body["exposure_index"] = "one"
+
+    def reject():
+        try:
+            validate_body("add_project_data", bad_body)
+        except ValidationError:
+            pass
+    seconds = timeit.timeit(reject, number=number)
+    _report("add_project_data (rejected)", seconds, number)
+
+
+def _stored_project(index):
+    """Returns a project as DynamoDB would return it, with Decimals and sets."""
+
+    project = copy.deepcopy(EXAMPLE_PROJECT)
+    project["project_name"] = f"{EXAMPLE_PROJECT['project_name']} {index}"
+    project["project_constraints"]["max_airmass"] = decimal.Decimal("2.5")
+    project["remaining"] = [decimal.Decimal(3), decimal.Decimal(30)]
+    project["project_data"] = [
+        [f"sro-kb001ms-20220426-{index:04d}{frame:04d}" for frame in range(3)],
+        [],
+    ]
+    project["scheduled_with_events"] = {f"event-{index}-{n}" for n in range(2)}
+    return project
+
+
+def bench_responses(project_counts=(10, 100, 1000), number=20):
+    """Compares payload size and encode time for large project lists."""
+
+    # handler.py reads these at import time but makes no AWS calls.
+    os.environ.setdefault("PROJECTS_TABLE", "projects-benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    from compression import SUPPORTED_ENCODINGS, compress_body
+    from handler import DecimalEncoder, to_json
+
+    print("Response encoding (get-all-projects)")
+    for count in project_counts:
+        projects = [_stored_project(i) for i in range(count)]
+        variants = {
+            # How getAllProjects encoded responses before to_json.
+            "previous json": lambda: json.dumps(projects, cls=DecimalEncoder),
+            "compact json": lambda: to_json(projects),
+        }
+        for encoding in SUPPORTED_ENCODINGS:
+            variants[f"compact json + {encoding}"] = (
+                lambda encoding=encoding: compress_body(to_json(projects), encoding)
+            )
+
+        for name, encode in variants.items():
+            size = len(encode())
+            seconds = timeit.timeit(encode, number=number)
+            print(f"{count:>5} projects, {name:<24} {size:>10} bytes "
+                  f"{seconds / number * 1e3:8.2f} ms/call")
+
+
+if __name__ == "__main__":
+    bench_validation()
+    print()
+    bench_responses()
@@ -0,0 +1,113 @@
+"""In-process read-through cache for project items.
+
+Lambda reuses warm containers between invocations, so module-level state
+survives from one request to the next. During an observing night the same
+few active projects are polled repeatedly, and caching them here saves a
+DynamoDB read on every repeat.
+
+Each Lambda function runs in its own containers, so a write handled by
+one function (eg. add-project-data) cannot invalidate the cache of another
+(eg. get-project). Entries therefore expire after a fixed TTL, which is the
+upper bound on how stale a cached project can be. Writes handled in the
+same container invalidate their entry immediately.
+
+The cache is disabled unless PROJECT_CACHE_TTL_S is set to a positive
+number of seconds.
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+
+class ProjectCache:
+    """A size-bounded LRU cache whose entries expire after a TTL.
+
+    Keys are (project_name, created_at) tuples. A generation counter is
+    bumped on every invalidation, and each entry records the generation its
+    read started at, so that a read which started before a write can't store
+    its older result afterwards. The generations of recent invalidations are
+    kept in an LRU of the same size as the cache. Once one is pruned, any
+    entry read before it is treated as stale, so pruning can only cause
+    extra misses.
+    """
+
+    def __init__(self, ttl_s=0.0, max_size=128, clock=time.monotonic):
+        self.ttl_s = ttl_s
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, generation, item)
+        self._generation = 0
+        self._invalidations = OrderedDict()  # key -> generation of its latest invalidation
+        self._pruned_generation = 0  # latest generation dropped from _invalidations
+
+    @property
+    def enabled(self):
+        return self.ttl_s > 0 and self.max_size > 0
+
+    def version(self, key):
+        """Returns the version to pass back to put() once a read of key is done."""
+        return self._generation
+
+    def _invalidated_at(self, key):
+        return self._invalidations.get(key, self._pruned_generation)
+
+    def get(self, key):
+        """Returns the cached item for a key, or None on a miss."""
+
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self.clock() or entry[1] < self._invalidated_at(key):
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, item, version):
+        """Caches an item read at the given version of its key.
+
+        The item is dropped if the key was invalidated since the read began.
+        """
+
+        if not self.enabled or version < self._invalidated_at(key):
+            return
+        self._entries[key] = (self.clock() + self.ttl_s, version, item)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drops a key after the project it refers to has been written."""
+
+        if not self.enabled:
+            return
+        self._entries.pop(key, None)
+        self._generation += 1
+        self._invalidations[key] = self._generation
+        self._invalidations.move_to_end(key)
+        while len(self._invalidations) > self.max_size:
+            _, generation = self._invalidations.popitem(last=False)
+            self._pruned_generation = max(self._pruned_generation, generation)
+
+    def clear(self):
+        self._entries.clear()
+        self._invalidations.clear()
+        self._pruned_generation = self._generation
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+        }
+
+
+project_cache = ProjectCache(
+    ttl_s=float(os.environ.get("PROJECT_CACHE_TTL_S", "0")),
+    max_size=int(os.environ.get("PROJECT_CACHE_MAX_SIZE", "128")),
+)
@@ -0,0 +1,101 @@
+"""Content-encoding negotiation and compression for API responses.
+
+By default API Gateway compresses responses itself (minimumCompressionSize
+in serverless.yml), and handlers return plain text bodies. Set
+COMPRESS_RESPONSES=true to compress in the handlers instead, which adds
+brotli support.
+
+API Gateway passes a Lambda proxy response body through as text unless the
+response sets isBase64Encoded, in which case it decodes the body to bytes
+before sending it. Compressed bodies are therefore returned base64 encoded.
+This requires binaryMediaTypes to be configured for the API, and with it
+ContentHandling CONVERT_TO_TEXT on every CORS preflight (see the README).
+
+Brotli is used when the optional 'brotli' package is installed and the
+client accepts it. Otherwise gzip from the standard library is used.
+"""
+
+import base64
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Whether handlers compress responses themselves.
+COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "false").lower() == "true"
+
+# Bodies smaller than this aren't worth the CPU time or the base64 overhead.
+MIN_COMPRESS_BYTES = 1024
+
+# Most preferred first.
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def get_header(event, name):
+    """Returns a request header from an API Gateway event, ignoring case."""
+
+    headers = (event or {}).get("headers") or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks the preferred supported encoding allowed by an Accept-Encoding.
+
+    Args:
+        accept_encoding (str): Value of the request's Accept-Encoding header.
+
+    Returns:
+        str: "br" or "gzip", or None if the body should not be compressed.
+    """
+
+    if not accept_encoding:
+        return None
+
+    accepted = set()
+    refused = set()  # codings listed with q=0, which '*' must not select
+    for token in accept_encoding.split(","):
+        coding, _, params = token.strip().partition(";")
+        coding = coding.strip().lower()
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) == 0:
+                    refused.add(coding)
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding)
+
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in refused:
+            continue
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def compress_body(body, encoding):
+    """Compresses a text body and returns it base64 encoded for API Gateway.
+
+    Args:
+        body (str): Response body.
+        encoding (str): "br" or "gzip", as returned by negotiate_encoding.
+
+    Returns:
+        str: the compressed body, base64 encoded.
+    """
+
+    data = body.encode("utf-8")
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=5)
+    else:
+        compressed = gzip.compress(data, compresslevel=6)
+    return base64.b64encode(compressed).decode("ascii")
@@ -0,0 +1,341 @@
+"""Shared DynamoDB access layer for the projects handlers.
+
+The projects table and its indexes are provisioned with very little
+capacity (see serverless.yml), so bursts of requests get throttled. Every
+table call made by handler.py goes through ThrottledTable, which:
+
+- budgets capacity units, not calls. Reads draw from a bucket refilled at
+  the table's provisioned read capacity, and each index has its own read
+  bucket. Writes draw from a bucket refilled at the write capacity. Every
+  call asks DynamoDB for its ConsumedCapacity, and the bucket is debited
+  by what it actually used. Scans read small pages (SCAN_PAGE_SIZE items),
+  so a single call can't take a large share of the capacity at once.
+- retries throttled and transient errors, including connection errors
+  and timeouts, with full-jitter exponential backoff. botocore's own
+  retries are turned off so every retry is counted here.
+- adapts each bucket's rate: it halves when DynamoDB throttles a call
+  and creeps back up as calls succeed.
+- counts throttles, retries and failures in `metrics` and logs each one
+  as a CloudWatch Embedded Metric Format line.
+
+The buckets belong to one container. Each handler is its own Lambda
+function with its own containers, so they don't share a budget. Together
+they can still exceed the table's capacity, and DynamoDB's throttling, with
+the rate halving above, is what brings them back under it.
+
+When throttling outlasts every retry, ThrottledError is raised.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+
+THROTTLE_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+TRANSIENT_ERROR_CODES = {
+    "InternalServerError",
+    "ServiceUnavailable",
+}
+
+METRICS_NAMESPACE = "photonranch-projects"
+
+
+class ThrottledError(Exception):
+    """Raised when a DynamoDB call is still throttled after every retry."""
+
+
+#=========================================#
+#=======          Metrics         ========#
+#=========================================#
+
+# (metric name, operation) -> count, for the life of this container.
+metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def record_metric(name, operation, value=1):
+    """Counts a metric and logs it in CloudWatch Embedded Metric Format."""
+
+    with _metrics_lock:
+        metrics[(name, operation)] += value
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Operation"]],
+                "Metrics": [{"Name": name, "Unit": "Count"}],
+            }],
+        },
+        "Operation": operation,
+        name: value,
+    }))
+
+
+def metrics_summary():
+    """Returns the metric counts as {metric name: {operation: count}}."""
+
+    summary = {}
+    with _metrics_lock:
+        for (name, operation), count in metrics.items():
+            summary.setdefault(name, {})[operation] = count
+    return summary
+
+
+#=========================================#
+#=======      Rate Limiting       ========#
+#=========================================#
+
+class TokenBucket:
+    """A thread-safe token bucket whose refill rate adapts to throttling.
+
+    Args:
+        rate (float): Tokens added per second, and the most the rate can
+            recover to after throttling.
+        burst (float): Most tokens the bucket can hold.
+        min_rate (float): Lowest rate that throttling can reduce it to.
+    """
+
+    def __init__(self, rate, burst, min_rate=0.5, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Takes one token, waiting for it if the bucket is empty."""
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_s = (1 - self._tokens) / self.rate
+            self.sleep(wait_s)
+
+    def debit(self, tokens):
+        """Takes extra tokens, or returns some if negative.
+
+        The bucket may go negative, which makes the next acquire() wait
+        until the debt is repaid.
+        """
+
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.burst, self._tokens - tokens)
+
+    def on_throttle(self):
+        """Halves the rate after DynamoDB throttled a call."""
+
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        """Recovers the rate a little after a call succeeded."""
+
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _parse_index_rates(value):
+    """Parses "index-name=rate,other-index=rate" into {index name: rate}."""
+
+    rates = {}
+    for pair in value.split(","):
+        if pair.strip():
+            index_name, _, rate = pair.partition("=")
+            rates[index_name.strip()] = float(rate)
+    return rates
+
+
+# Provisioned capacity, in capacity units per second (see serverless.yml).
+READ_UNITS_PER_S = _env_float("DYNAMODB_READ_UNITS_PER_S", 1)
+WRITE_UNITS_PER_S = _env_float("DYNAMODB_WRITE_UNITS_PER_S", 1)
+# Read capacity of indexes, which defaults to the table's.
+INDEX_READ_UNITS_PER_S = _parse_index_rates(os.environ.get("DYNAMODB_INDEX_READ_UNITS_PER_S", ""))
+# DynamoDB keeps up to 300 s of unused capacity for bursts.
+BURST_S = _env_float("DYNAMODB_BURST_S", 300)
+# Items read per scan call.
+SCAN_PAGE_SIZE = int(os.environ.get("DYNAMODB_SCAN_PAGE_SIZE", "25"))
+
+
+def capacity_bucket(units_per_s):
+    """Returns a token bucket of capacity units for a provisioned rate."""
+    return TokenBucket(rate=units_per_s, burst=max(1, units_per_s * BURST_S))
+
+
+#=========================================#
+#=======        Table Access      ========#
+#=========================================#
+
+# DYNAMODB_ENDPOINT_URL points at a local stand-in such as DynamoDB Local
+# (see replay.py). It is unset in deployed stages.
+resource = boto3.resource(
+    "dynamodb",
+    endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL"),
+    config=Config(retries={"mode": "standard", "max_attempts": 1}),
+)
+
+
+class ThrottledTable:
+    """Wraps a boto3 Table so every call is rate limited and retried.
+
+    Methods take the same keyword arguments as the boto3 Table methods.
+
+    Args:
+        table: boto3 Table.
+        reads (TokenBucket): read capacity of the table.
+        writes (TokenBucket): write capacity of the table.
+        index_reads (dict): index name -> TokenBucket of its read capacity.
+            Buckets for other indexes are made as needed at the table's
+            provisioned read rate.
+    """
+
+    def __init__(self, table, max_attempts=6, base_delay_s=0.05, max_delay_s=2.0,
+                 reads=None, writes=None, index_reads=None, sleep=time.sleep):
+        self.table = table
+        self.name = table.name
+        self.max_attempts = max_attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.reads = reads or capacity_bucket(READ_UNITS_PER_S)
+        self.writes = writes or capacity_bucket(WRITE_UNITS_PER_S)
+        self.index_reads = dict(index_reads or {})
+        self.sleep = sleep
+
+    def _index_bucket(self, index_name):
+        if index_name not in self.index_reads:
+            rate = INDEX_READ_UNITS_PER_S.get(index_name, READ_UNITS_PER_S)
+            self.index_reads[index_name] = capacity_bucket(rate)
+        return self.index_reads[index_name]
+
+    def _read_bucket(self, kwargs):
+        index_name = kwargs.get("IndexName")
+        return self._index_bucket(index_name) if index_name else self.reads
+
+    def get_item(self, **kwargs):
+        return self._call("GetItem", self.table.get_item, self.reads, kwargs)
+
+    def put_item(self, **kwargs):
+        return self._call("PutItem", self.table.put_item, self.writes, kwargs)
+
+    def update_item(self, **kwargs):
+        return self._call("UpdateItem", self.table.update_item, self.writes, kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._call("DeleteItem", self.table.delete_item, self.writes, kwargs)
+
+    def query(self, **kwargs):
+        return self._call("Query", self.table.query, self._read_bucket(kwargs), kwargs)
+
+    def scan(self, **kwargs):
+        kwargs.setdefault("Limit", SCAN_PAGE_SIZE)
+        return self._call("Scan", self.table.scan, self._read_bucket(kwargs), kwargs)
+
+    def _call(self, operation, method, bucket, kwargs):
+        # INDEXES reports the table's and each index's share separately.
+        # Writes are budgeted against the table's share, since the indexes'
+        # write capacity is provisioned to match it. Unless the caller asked
+        # for ConsumedCapacity, it is removed from the response again.
+        report_capacity = "ReturnConsumedCapacity" not in kwargs
+        kwargs.setdefault("ReturnConsumedCapacity", "INDEXES")
+        for attempt in range(1, self.max_attempts + 1):
+            # One unit is taken up front; the rest is debited once the call
+            # reports what it consumed.
+            bucket.acquire()
+            try:
+                response = method(**kwargs)
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                throttled = code in THROTTLE_ERROR_CODES
+                if not throttled and code not in TRANSIENT_ERROR_CODES:
+                    raise
+                error = e
+            except (BotocoreConnectionError, HTTPClientError) as e:
+                # Connection resets, timeouts and unreachable endpoints, which
+                # botocore would have retried if its retries were enabled.
+                throttled = False
+                error = e
+            else:
+                if report_capacity:
+                    consumed = response.pop("ConsumedCapacity", None)
+                else:
+                    consumed = response.get("ConsumedCapacity")
+                bucket.debit(consumed_units(consumed, kwargs.get("IndexName")) - 1)
+                bucket.on_success()
+                return response
+
+            if throttled:
+                record_metric("DynamoDBThrottles", operation)
+                bucket.on_throttle()
+            if attempt == self.max_attempts:
+                record_metric("DynamoDBFailures", operation)
+                if throttled:
+                    raise ThrottledError(
+                        f"{operation} on {self.name} throttled after {attempt} attempts"
+                    ) from error
+                raise error
+            record_metric("DynamoDBRetries", operation)
+            # Full jitter: sleep a random time up to the backoff ceiling.
+            ceiling_s = min(self.max_delay_s, self.base_delay_s * 2 ** attempt)
+            self.sleep(random.uniform(0, ceiling_s))
+
+
+def consumed_units(consumed, index_name=None):
+    """Returns the capacity units a call consumed, or 1 if not reported.
+
+    Args:
+        consumed (dict): ConsumedCapacity from a DynamoDB response.
+        index_name (str): Index that was queried or scanned, if any. Its
+            share is returned instead of the table's.
+    """
+
+    if not consumed:
+        return 1
+    if index_name:
+        part = consumed.get("GlobalSecondaryIndexes", {}).get(index_name, {})
+    else:
+        part = consumed.get("Table", {})
+    return float(part.get("CapacityUnits", consumed.get("CapacityUnits", 1)))
+
+
+_tables = {}
+
+
+def get_table(table_name):
+    """Returns the shared ThrottledTable for a table name."""
+
+    if table_name not in _tables:
+        _tables[table_name] = ThrottledTable(resource.Table(table_name))
+    return _tables[table_name]
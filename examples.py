@@ -10,10 +10,13 @@ All projects endpoints:
 /modify-project
 /get-project
 /add-project-data
+/queue-project-data
 /add-project-event
+/remove-project-event
 /delete-project
 /get-all-projects
 /get-user-projects
+/search-projects
 
 For more details, refer to this repository's README.
 """
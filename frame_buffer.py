@@ -0,0 +1,102 @@
+"""Durable buffer for frame reports sent to /queue-project-data.
+
+Fast-cadence sequences can report several frames a second for the same
+project. Instead of writing each frame to DynamoDB as it arrives, the
+queue-project-data endpoint puts the frame report on an SQS queue and
+returns right away. The processProjectDataQueue consumer then receives
+frames in batches and folds every frame for a project into one update.
+
+For local runs such as replay.py, set PROJECT_DATA_QUEUE_URL to "local"
+to use an in-memory LocalFrameBuffer instead of the queue. Its drain()
+method returns records in the same shape as an SQS event, so they can be
+passed straight to the consumer. It is never used by default, since in a
+deployed Lambda it would accept frames and then lose them.
+"""
+
+import json
+import os
+import uuid
+from collections import OrderedDict
+
+import boto3
+
+
+class SQSFrameBuffer:
+    """Buffers frame reports in an SQS queue."""
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self.sqs = boto3.client("sqs")
+
+    def put(self, frame):
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(frame))
+
+
+class LocalFrameBuffer:
+    """In-memory stand-in for SQSFrameBuffer, for local development."""
+
+    def __init__(self):
+        self._records = []
+
+    def put(self, frame):
+        self._records.append({
+            "messageId": str(uuid.uuid4()),
+            "body": json.dumps(frame),
+        })
+
+    def drain(self):
+        """Removes and returns all buffered frames as SQS event records."""
+        records, self._records = self._records, []
+        return records
+
+    def __len__(self):
+        return len(self._records)
+
+
+# PROJECT_DATA_QUEUE_URL value that selects the in-memory LocalFrameBuffer.
+LOCAL_QUEUE_URL = "local"
+
+_frame_buffer = None
+
+
+def get_frame_buffer():
+    """Returns the frame buffer for this container, creating it if needed.
+
+    Raises:
+        RuntimeError: if PROJECT_DATA_QUEUE_URL is not set.
+    """
+
+    global _frame_buffer
+    if _frame_buffer is None:
+        queue_url = os.environ.get("PROJECT_DATA_QUEUE_URL")
+        if not queue_url:
+            raise RuntimeError("PROJECT_DATA_QUEUE_URL must be set to an SQS queue url, "
+                               f"or to '{LOCAL_QUEUE_URL}' for local runs")
+        if queue_url == LOCAL_QUEUE_URL:
+            _frame_buffer = LocalFrameBuffer()
+        else:
+            _frame_buffer = SQSFrameBuffer(queue_url)
+    return _frame_buffer
+
+
+def fold_frames(records):
+    """Groups frame records from an SQS event by the project they belong to.
+
+    Args:
+        records (list): SQS event records, each with a JSON body holding
+            project_name, created_at, exposure_index and base_filename.
+
+    Returns:
+        OrderedDict: maps (project_name, created_at) to a list of
+            (message_id, exposure_index, base_filename) tuples, in the
+            order they were received.
+    """
+
+    projects = OrderedDict()
+    for record in records:
+        frame = json.loads(record["body"])
+        key = (frame["project_name"], frame["created_at"])
+        projects.setdefault(key, []).append(
+            (record["messageId"], frame["exposure_index"], frame["base_filename"])
+        )
+    return projects
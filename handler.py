@@ -1,24 +1,46 @@
+import functools
 import json
 import os
-import boto3
 import decimal
 import requests
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
+from cache import project_cache
+from compression import (
+    COMPRESS_RESPONSES, MIN_COMPRESS_BYTES, compress_body, get_header, negotiate_encoding,
+)
+from db import ThrottledError, get_table
+from frame_buffer import fold_frames, get_frame_buffer
+from search import (
+    SEARCH_ATTRIBUTES, SEARCH_INDEX, SEARCH_PARTITION, InvalidPageToken,
+    decode_page_token, encode_page_token, normalize_prefix, search_attributes,
+)
+from traffic import capture_traffic
+from validation import ValidationError, validate_request
+
 
-dynamodb = boto3.resource('dynamodb')
 projects_table = os.environ['PROJECTS_TABLE']
 
+# deleteSchedulerProjects stops when less than this much time is left, which
+# covers a delete that waits out the full retry backoff in db.py.
+DELETE_TIME_MARGIN_MS = 5000
+
 
 #=========================================#
 #=======     Helper Functions     ========#
 #=========================================#
 
-def create_response(statusCode, message):
-    """Returns a given status code."""
+def create_response(statusCode, message, event=None):
+    """Returns a given status code.
+
+    If COMPRESS_RESPONSES is set, the request event is passed in and its
+    Accept-Encoding header allows it, bodies of at least MIN_COMPRESS_BYTES
+    are compressed with br or gzip and base64 encoded for API Gateway.
+    Otherwise API Gateway compresses the response (see serverless.yml).
+    """
 
-    return { 
+    response = { 
         'statusCode': statusCode,
         'headers': {
             # Required for CORS support to work
@@ -28,14 +50,74 @@ def create_response(statusCode, message):
         },
         'body': message
     }
+    if event is None or not COMPRESS_RESPONSES:
+        return response
+
+    response['headers']['Vary'] = 'Accept-Encoding'
+    encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+    if encoding and len(message) >= MIN_COMPRESS_BYTES:
+        response['body'] = compress_body(message, encoding)
+        response['headers']['Content-Encoding'] = encoding
+        response['isBase64Encoded'] = True
+    return response
+
+
+def to_json(obj):
+    """Serializes a response body as compact JSON, including DynamoDB types."""
+
+    return json.dumps(obj, cls=DecimalEncoder, separators=(',', ':'))
+
+
+def wants_minimal_response(event):
+    """Checks if a request asked write endpoints to omit the project details.
+
+    Clients opt in with the standard 'Prefer: return=minimal' header, or with
+    a '?return=minimal' query string (which needs no CORS preflight changes),
+    and then receive only the project keys and the status of the write.
+    """
+
+    query = event.get('queryStringParameters') or {}
+    if query.get('return') == 'minimal':
+        return True
+    prefer = get_header(event, 'Prefer') or ''
+    return 'return=minimal' in prefer.replace(' ', '').lower()
+
+
+def unavailable_when_throttled(handler):
+    """Decorates a handler to return 503 if DynamoDB stays throttled.
+
+    The db module already retries throttled calls with backoff, so by the
+    time ThrottledError reaches a handler the client should back off too.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        except ThrottledError as e:
+            print(f"ThrottledError: {e}")
+            response = create_response(503, to_json({"message": "Projects database is busy, please retry."}))
+            response['headers']['Retry-After'] = '1'
+            return response
+
+    return wrapper
+
+
+def bad_request(error):
+    """Returns a 400 response describing why a request was rejected."""
+
+    msg = f"Error: {error}"
+    print(msg)
+    return create_response(400, to_json(msg))
 
 
 class DecimalEncoder(json.JSONEncoder):
     """Helper class to convert a DynamoDB item to JSON."""
 
     def default(self, o):
+        # Sorted, so a set encodes the same way every time it is read.
         if isinstance(o, set):
-            return list(o)
+            return sorted(o)
         if isinstance(o, decimal.Decimal):
             if o % 1 != 0:
                 return float(o)
@@ -63,10 +145,131 @@ def removeProjectFromCalendarEvents(list_of_event_ids):
     calendarURL = f"https://calendar.photonranch.org/{stage}/remove-project-from-events"
     requestBody = json.dumps({
         "events": list_of_event_ids
-    })
+    }, cls=DecimalEncoder)
     requests.post(calendarURL, requestBody)
 
 
+def format_project(project):
+    """Prepares a stored project item to be returned to clients.
+
+    Linked calendar events are stored as a DynamoDB string set, and DynamoDB
+    drops a set attribute entirely once it is empty. Clients still expect
+    the 'scheduled_with_events' key, so restore it as an empty set.
+
+    The attributes kept only for the search index are removed.
+    """
+
+    project.setdefault("scheduled_with_events", set())
+    for attribute in SEARCH_ATTRIBUTES:
+        project.pop(attribute, None)
+    return project
+
+
+def store_event_links(dynamodb_entry):
+    """Converts a project's list of linked event ids into a string set.
+
+    DynamoDB does not allow empty sets, so a project with no linked events
+    is stored without the 'scheduled_with_events' attribute.
+    """
+
+    event_ids = dynamodb_entry.pop("scheduled_with_events", None)
+    if event_ids:
+        dynamodb_entry["scheduled_with_events"] = set(event_ids)
+    return dynamodb_entry
+
+
+def migrate_event_links(table, key):
+    """Converts a project's legacy list of linked events into a string set.
+
+    Projects created before event links were stored as a set keep them in a
+    list, which DynamoDB's ADD and DELETE actions cannot operate on.
+
+    Args:
+        table: DynamoDB table resource.
+        key (dict): project_name and created_at of the project.
+
+    Returns:
+        bool: whether the project still had a legacy list to convert.
+    """
+
+    response = table.get_item(Key=key, ProjectionExpression="scheduled_with_events")
+    event_ids = response.get("Item", {}).get("scheduled_with_events")
+    if not isinstance(event_ids, list):
+        return False
+
+    if event_ids:
+        update_expression = "SET scheduled_with_events = :event_set"
+        expression_values = {":event_set": set(event_ids), ":event_list": event_ids}
+    else:
+        update_expression = "REMOVE scheduled_with_events"
+        expression_values = {":event_list": event_ids}
+
+    # Only replace the list we read, in case it changed in the meantime.
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression=update_expression,
+            ConditionExpression="scheduled_with_events = :event_list",
+            ExpressionAttributeValues=expression_values,
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != "ConditionalCheckFailedException":
+            raise
+        print(f"event links for {key} changed during migration")
+    return True
+
+
+def update_event_links(table, project_name, created_at, event_id, action):
+    """Adds or removes a calendar event id in a project's set of events.
+
+    The change is a single conditional write, so concurrent updates for
+    different events cannot overwrite each other.
+
+    Args:
+        table: DynamoDB table resource.
+        project_name (str): Name of the project to update.
+        created_at (str): UTC datetime string of project creation.
+        event_id (str): Id of the calendar event.
+        action (str): Either "ADD" or "DELETE".
+
+    Returns:
+        set: Event ids that were linked to the project before this update.
+
+    Raises:
+        ClientError: with code ConditionalCheckFailedException if the
+            project does not exist.
+    """
+
+    key = {
+        "project_name": project_name,
+        "created_at": created_at,
+    }
+
+    def update():
+        return table.update_item(
+            Key=key,
+            UpdateExpression=f"{action} scheduled_with_events :event_ids",
+            ConditionExpression="attribute_exists(project_name)",
+            ExpressionAttributeValues={":event_ids": {event_id}},
+            # UPDATED_OLD omits the set when the update leaves it unchanged,
+            # which would hide that the event was already linked.
+            ReturnValues="ALL_OLD",
+        )
+
+    try:
+        response = update()
+    except ClientError as e:
+        # ADD and DELETE fail with a ValidationException on a legacy list.
+        if e.response['Error']['Code'] != "ValidationException":
+            raise
+        if not migrate_event_links(table, key):
+            raise
+        response = update()
+    project_cache.invalidate((project_name, created_at))
+
+    return response.get("Attributes", {}).get("scheduled_with_events", set())
+
+
 #=========================================#
 #=======       Core Methods       ========#
 #=========================================#
@@ -80,7 +283,9 @@ def modify_project(project_name: str, created_at: str, project_changes: dict):
             the existing project we want to modify.
         project_changes (dict): These are the changes we want to apply. The 
             format of this dict should be the same as if we were adding a new
-            project.
+            project. Its 'scheduled_with_events' is ignored: links only
+            change through addProjectEvent and removeProjectEvent, and the
+            stored set is kept.
 
     Returns:
         dict: contains the following keys:
@@ -89,9 +294,10 @@ def modify_project(project_name: str, created_at: str, project_changes: dict):
             updated_project (str): the state of the project after the update.
     """
 
-    table = dynamodb.Table(projects_table)
+    table = get_table(projects_table)
 
-    old_project = get_project(project_name, created_at)
+    # Always read the latest copy, since the update is based on it.
+    old_project = get_project(project_name, created_at, use_cache=False)
 
     # If the project specified by project_name and created_at is not found:
     if not old_project["project_exists"]: 
@@ -110,7 +316,6 @@ def modify_project(project_name: str, created_at: str, project_changes: dict):
     updated_project["project_note"] = project_changes["project_note"]
     updated_project["project_targets"] = project_changes["project_targets"]
     updated_project["project_sites"] = project_changes["project_sites"]
-    updated_project["scheduled_with_events"] = project_changes["scheduled_with_events"]
     updated_project["project_priority"] = project_changes["project_priority"]
 
     # A tricky detail is how to keep track of existing project data for 
@@ -140,16 +345,32 @@ def modify_project(project_name: str, created_at: str, project_changes: dict):
     updated_project["remaining"] = updated_remaining_data
     updated_project["exposures"] = project_changes["exposures"]
 
-    # Delete the existing project from the table
-    table.delete_item(
+    # Delete the existing project from the table. Its event links are taken
+    # from the deleted item rather than the earlier read, so links added in
+    # the meantime are kept. Links added after the delete fail with a 404
+    # until the project is put back.
+    delete_response = table.delete_item(
         Key={
             "project_name": project_name,
             "created_at": created_at
         },
+        ReturnValues="ALL_OLD",
     )
+    if "Attributes" not in delete_response:
+        return {
+            "is_successful": False,
+            "description": "The requested project does not exist.",
+            "updated_project": []
+        }
+    updated_project["scheduled_with_events"] = delete_response["Attributes"].get("scheduled_with_events", [])
     # Add the updated project back
     dynamodb_entry = json.loads(json.dumps(updated_project, cls=DecimalEncoder), parse_float=decimal.Decimal)
+    store_event_links(dynamodb_entry)
+    # The name may have changed, so the search index entry must be updated.
+    dynamodb_entry.update(search_attributes(dynamodb_entry["project_name"]))
     table_response = table.put_item(Item=dynamodb_entry)
+    project_cache.invalidate((project_name, created_at))
+    project_cache.invalidate((dynamodb_entry["project_name"], created_at))
     
     return {
         "is_successful": True,
@@ -158,19 +379,142 @@ def modify_project(project_name: str, created_at: str, project_changes: dict):
     }
         
     
-def get_project(project_name, created_at):
+class ProjectUpdateConflict(Exception):
+    """Raised when a project keeps changing between our read and our write."""
+
+
+def add_frames_to_project(project_name, created_at, frames, max_attempts=5):
+    """Adds completed frames to a project's data with one DynamoDB update.
+
+    The 'project_data' and 'remaining' arrays are read, updated with every
+    frame, and written back on the condition that neither changed since
+    they were read. If another write got there first, the whole update is
+    retried from a fresh read, so concurrent reports are never lost.
+
+    Frames whose filename is already recorded for that exposure are skipped,
+    so a report that is delivered twice doesn't decrement 'remaining' twice.
+
+    Args:
+        project_name (str): Name of the project to update.
+        created_at (str): UTC datetime string of project creation.
+        frames (list): (exposure_index, base_filename) tuples to add.
+        max_attempts (int): Number of read-modify-write attempts.
+
+    Returns:
+        dict: contains the following keys:
+            project_exists (bool): whether the project was found.
+            added (list): frames that were written to the project.
+            duplicates (list): frames that were already recorded.
+            out_of_range (list): frames with an exposure_index the project
+                doesn't have.
+
+    Raises:
+        ProjectUpdateConflict: if every attempt lost a race with another write.
+    """
+
+    table = get_table(projects_table)
+    key = {
+        "project_name": project_name,
+        "created_at": created_at,
+    }
+    attribute_names = {
+        "#project_data": "project_data",
+        "#remaining": "remaining",
+    }
+
+    for attempt in range(max_attempts):
+        # 'project_data[exposure_index]' stores filenames of completed exposures.
+        # 'remaining[exposure_index]' is the number of exposures remaining.
+        response = table.get_item(
+            Key=key,
+            ProjectionExpression="#project_data, #remaining",
+            ExpressionAttributeNames=attribute_names,
+        )
+        result = {
+            "project_exists": "Item" in response,
+            "added": [],
+            "duplicates": [],
+            "out_of_range": [],
+        }
+        if not result["project_exists"]:
+            return result
+
+        old_project_data = response["Item"]["project_data"]
+        old_remaining = response["Item"]["remaining"]
+        project_data = [list(filenames) for filenames in old_project_data]
+        remaining = list(old_remaining)
+
+        for frame in frames:
+            exposure_index, base_filename = frame
+            # Projects stored before the lists were validated may differ in length.
+            if exposure_index >= min(len(project_data), len(remaining)):
+                result["out_of_range"].append(frame)
+            elif base_filename in project_data[exposure_index]:
+                result["duplicates"].append(frame)
+            else:
+                project_data[exposure_index].append(base_filename)
+                remaining[exposure_index] = int(remaining[exposure_index]) - 1
+                result["added"].append(frame)
+
+        if not result["added"]:
+            return result
+
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression="SET #project_data = :project_data_updated, #remaining = :remaining_updated",
+                ConditionExpression="#project_data = :project_data_old AND #remaining = :remaining_old",
+                ExpressionAttributeNames=attribute_names,
+                ExpressionAttributeValues={
+                    ":project_data_updated": project_data,
+                    ":remaining_updated": remaining,
+                    ":project_data_old": old_project_data,
+                    ":remaining_old": old_remaining,
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+            print(f"project {key} changed during update, retrying (attempt {attempt + 1})")
+            continue
+
+        project_cache.invalidate((project_name, created_at))
+        print(f"updated values: {project_data} {remaining}")
+        return result
+
+    raise ProjectUpdateConflict(f"project {key} changed on every attempt to update it")
+
+
+def get_project(project_name, created_at, use_cache=True):
     """Retrieves details of a specified project from the DynamoDB table.
+
+    Recently read projects are served from the in-process project_cache
+    when it is enabled, so repeated polling of the same project within
+    PROJECT_CACHE_TTL_S seconds doesn't read from DynamoDB again.
     
     Args:
         project_name (str): Name of the project we want to retrieve.
         created_at (str): UTC datetime string of project creation.
+        use_cache (bool): Set to False to always read from DynamoDB, eg. 
+            before a read-modify-write. Callers using the cache must not
+            mutate the returned project.
 
     Returns:
         List of project details, if it exists.
         Otherwise, an empty list.
     """
 
-    table = dynamodb.Table(projects_table)
+    cache_key = (project_name, created_at)
+    if use_cache:
+        cached_project = project_cache.get(cache_key)
+        if cached_project is not None:
+            return {
+                "project_exists": True,
+                "project": cached_project
+            }
+    cache_version = project_cache.version(cache_key)
+
+    table = get_table(projects_table)
 
     response = table.get_item(
         Key={
@@ -179,9 +523,12 @@ def get_project(project_name, created_at):
         }
     )
     if 'Item' in response:
+        project = format_project(response['Item'])
+        if use_cache:
+            project_cache.put(cache_key, project, cache_version)
         return {
             "project_exists": True,
-            "project": response['Item']
+            "project": project
         }
     else: 
         return {
@@ -194,6 +541,8 @@ def get_project(project_name, created_at):
 #=======          Handlers        ========#
 #=========================================#
 
+@capture_traffic
+@unavailable_when_throttled
 def addNewProject(event, context):
     """Adds a new project to the projects DynamoDB database.
 
@@ -204,36 +553,42 @@ def addNewProject(event, context):
 
     Returns:
         200 status code with project details if successful.
-        400 status code if project missing required keys.
+        400 status code if project is missing required keys or malformed.
     """
     
-    event_body = json.loads(event.get("body", ""))
-    table = dynamodb.Table(projects_table)
+    try:
+        event_body = validate_request(event, "new_project")
+    except ValidationError as e:
+        return bad_request(e)
+    table = get_table(projects_table)
 
     print("event_body:")
     print(event_body)
 
-    # Check that all required keys are present.
-    required_keys = ['project_name', 'user_id', 'created_at']
-    actual_keys = event_body.keys()
-    for key in required_keys:
-        if key not in actual_keys:
-            msg = f"Error: missing required key {key}"
-            print(msg)
-            return create_response(400, msg)
-
     # Convert floats into decimals for dynamodb
     dynamodb_entry = json.loads(json.dumps(event_body), parse_float=decimal.Decimal)
+    store_event_links(dynamodb_entry)
+    dynamodb_entry.update(search_attributes(event_body["project_name"]))
 
     table_response = table.put_item(Item=dynamodb_entry)
-
-    message = json.dumps({
-        'table_response': table_response,
-        'new_project': event_body,
-    })
-    return create_response(200, message)
+    project_cache.invalidate((event_body["project_name"], event_body["created_at"]))
+
+    if wants_minimal_response(event):
+        message = to_json({
+            'project_name': event_body['project_name'],
+            'created_at': event_body['created_at'],
+            'status': 'created',
+        })
+    else:
+        message = to_json({
+            'table_response': table_response,
+            'new_project': event_body,
+        })
+    return create_response(200, message, event)
 
 
+@capture_traffic
+@unavailable_when_throttled
 def modify_project_handler(event, context):
     """Handler method to create a response code after modifying a project.
 
@@ -248,7 +603,11 @@ def modify_project_handler(event, context):
     """
     
     try:
-        event_body = json.loads(event.get("body", ""))
+        event_body = validate_request(event, "modify_project")
+    except ValidationError as e:
+        return bad_request(e)
+
+    try:
         print(event_body)
 
         project_name = event_body['project_name']
@@ -256,14 +615,27 @@ def modify_project_handler(event, context):
         project_changes = event_body['project_changes']
 
         response = modify_project(project_name, created_at, project_changes)
-        return create_response(200, json.dumps(response, cls=DecimalEncoder))
-    
+        if wants_minimal_response(event):
+            response = {
+                'project_name': project_changes['project_name'],
+                'created_at': created_at,
+                'is_successful': response['is_successful'],
+                'description': response['description'],
+            }
+        return create_response(200, to_json(response), event)
+
+    # Let unavailable_when_throttled return a 503.
+    except ThrottledError:
+        raise
+
     # Something else went wrong, return a Bad Request status code.
     except Exception as e:
         print(f"Exception: {e}")
-        return create_response(400, json.dumps(e))
+        return create_response(400, to_json(str(e)))
 
 
+@capture_traffic
+@unavailable_when_throttled
 def get_project_handler(event, context):
     """Handler method to retrieve the details of a project.
 
@@ -273,10 +645,14 @@ def get_project_handler(event, context):
 
     Returns:
         200 status code with project details if successful.
+        400 status code if the request is malformed.
         Otherwise, 404 status code if project does not exist.
     """
     
-    event_body = json.loads(event.get("body", ""))
+    try:
+        event_body = validate_request(event, "get_project")
+    except ValidationError as e:
+        return bad_request(e)
 
     print("event_body:")
     print(event_body)
@@ -285,13 +661,16 @@ def get_project_handler(event, context):
     created_at = event_body['created_at']
 
     project = get_project(project_name, created_at)
+    print(f"project cache: {project_cache.stats()}")
     if project["project_exists"]:
-        project_json = json.dumps(project["project"], cls=DecimalEncoder)
-        return create_response(200, project_json)
+        project_json = to_json(project["project"])
+        return create_response(200, project_json, event)
     else: 
         return create_response(404, "Project not found.")
 
 
+@capture_traffic
+@unavailable_when_throttled
 def getAllProjects(event, context):
     """Retrieves all existing projects and details from the DynamoDB table.
     
@@ -304,8 +683,9 @@ def getAllProjects(event, context):
         all_projects = requests.post(url).json()
     """
 
-    table = dynamodb.Table(projects_table)
+    table = get_table(projects_table)
 
+    # Scans read small pages, each debited from the read capacity budget.
     response = table.scan()
     data = response['Items']
 
@@ -313,9 +693,14 @@ def getAllProjects(event, context):
         response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
         data.extend(response['Items'])
 
-    return create_response(200, json.dumps(data, cls=DecimalEncoder))
+    for project in data:
+        format_project(project)
+
+    return create_response(200, to_json(data), event)
 
 
+@capture_traffic
+@unavailable_when_throttled
 def getUserProjects(event, context):
     """Retrieves the details of all projects created by a specified user.
 
@@ -327,44 +712,100 @@ def getUserProjects(event, context):
         400 status code if the required key 'user_id' is missing.
     """
     
-    event_body = json.loads(event.get("body", ""))
-    table = dynamodb.Table(projects_table)
+    try:
+        event_body = validate_request(event, "get_user_projects")
+    except ValidationError as e:
+        return bad_request(e)
+    table = get_table(projects_table)
 
     print("event_body:")
     print(event_body)
 
-    # Check that all required keys are present.
-    required_keys = ['user_id']
-    actual_keys = event_body.keys()
-    for key in required_keys:
-        if key not in actual_keys:
-            msg = f"Error: missing required key {key}"
-            print(msg)
-            return create_response(400, json.dumps(msg))
-
     response = table.query(
         IndexName="userid-createdat-index",
         KeyConditionExpression=Key('user_id').eq(event_body['user_id'])
     )
     print(response)
-    user_projects = json.dumps(response['Items'], cls=DecimalEncoder)
+    for project in response['Items']:
+        format_project(project)
+    user_projects = to_json(response['Items'])
+
+    return create_response(200, user_projects, event)
+
+
+@capture_traffic
+@unavailable_when_throttled
+def searchProjects(event, context):
+    """Finds projects whose name starts with a given prefix.
 
-    return create_response(200, user_projects)
+    Matching ignores case and repeated whitespace. Results come from the
+    projectname-search-index GSI, sorted by name, so a search reads only
+    the projects it returns no matter how large the table is. Each result
+    holds the project's key, user_id and project_sites; use get-project
+    for the full details.
+
+    Args:
+        event.body.prefix (str): Start of the project name. An empty prefix
+            lists every project in name order.
+        event.body.limit (int): Most projects to return, from 1 to 100.
+            Defaults to 20.
+        event.body.page_token (str): next_page_token from the previous page.
+
+    Returns:
+        200 status code with JSON containing the following keys:
+            projects (list): matching projects.
+            next_page_token (str): token for the next page, or null if
+                there are no more results.
+        400 status code if the request or page token is malformed.
+    """
+
+    try:
+        request_body = validate_request(event, "search_projects")
+        exclusive_start_key = None
+        if "page_token" in request_body:
+            exclusive_start_key = decode_page_token(request_body["page_token"])
+    except (ValidationError, InvalidPageToken) as e:
+        return bad_request(e)
+    table = get_table(projects_table)
+
+    key_condition = Key("search_partition").eq(SEARCH_PARTITION)
+    prefix = normalize_prefix(request_body["prefix"])
+    if prefix:
+        key_condition = key_condition & Key("search_name").begins_with(prefix)
+
+    query_kwargs = {
+        "IndexName": SEARCH_INDEX,
+        "KeyConditionExpression": key_condition,
+        "Limit": request_body.get("limit", 20),
+    }
+    if exclusive_start_key:
+        query_kwargs["ExclusiveStartKey"] = exclusive_start_key
+    response = table.query(**query_kwargs)
+
+    message = to_json({
+        "projects": [
+            {key: value for key, value in item.items() if key not in SEARCH_ATTRIBUTES}
+            for item in response["Items"]
+        ],
+        "next_page_token": encode_page_token(response.get("LastEvaluatedKey")),
+    })
+    return create_response(200, message, event)
 
 
+@capture_traffic
+@unavailable_when_throttled
 def addProjectEvent(event, context):
-    """Adds an associated calendar event to a project's list of events.
+    """Adds an associated calendar event to a project's set of events.
 
-    Projects keep a list of events that they are scheduled with. 
+    Projects keep a set of events that they are scheduled with. 
     This way, if a project is deleted, it can be removed from any 
     associated events.
 
-    We could use a set in DynamoDB to keep track of associated events. But that
-    gets complicated because JSON does not support sets, so we would need lots
-    of custom modifier code throughout the pipeline. 
-
-    Instead we'll keep it simple with a list. Get the list, check if already 
-    contains our event, and add it if not, then update DynamoDB. 
+    Event ids are stored in a DynamoDB string set and added with a single
+    conditional ADD, so linking costs one write regardless of how many
+    events are already linked, and concurrent reservations can't drop
+    each other's links. Sets are converted to lists by DecimalEncoder
+    whenever a project is returned as JSON.
 
     Args:
         event.body.project_name (str): Name of the project to add events to.
@@ -374,10 +815,15 @@ def addProjectEvent(event, context):
     Returns:
         200 status code if calendar event already exists in project's details.
         200 status code if successful adding event ids to the project.
+        400 status code if the request is malformed.
+        404 status code if the project does not exist.
     """
 
-    request_body = json.loads(event.get("body", ""))
-    table = dynamodb.Table(projects_table)
+    try:
+        request_body = validate_request(event, "add_project_event")
+    except ValidationError as e:
+        return bad_request(e)
+    table = get_table(projects_table)
 
     print("event_body:")
     print(request_body)
@@ -386,41 +832,72 @@ def addProjectEvent(event, context):
     created_at = request_body["created_at"]
     event_id = request_body["event_id"]  # ID of the calendar event
 
-    response = table.get_item(
-        Key={
-            "project_name": project_name,
-            "created_at": created_at
-        },
-    )
-    events_list = response['Item']['scheduled_with_events']
+    try:
+        previous_events = update_event_links(table, project_name, created_at, event_id, "ADD")
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+            return create_response(404, "Project not found.")
+        raise
 
-    # Don't add a duplicate
-    if event_id in events_list:
+    if event_id in previous_events:
         return create_response(200, 'Event already associated with this project')
+    return create_response(200, 'Successfully associated event with project.')
 
-    # Add the event to the list and then update the project in dynamodb
-    else:
-        events_list.append(event_id)
-        print(f"events_list: {events_list}")
 
-        update_response = table.update_item(
-            Key={
-                "project_name": project_name,
-                "created_at": created_at,
-            },
-            UpdateExpression="SET scheduled_with_events = :swe",
-            ExpressionAttributeValues={
-                ":swe": events_list
-            }
-        )
-        return create_response(200, 'Successfully associated event with project.')
+@capture_traffic
+@unavailable_when_throttled
+def removeProjectEvent(event, context):
+    """Removes an associated calendar event from a project's set of events.
+
+    This is the counterpart of addProjectEvent, used when a calendar
+    reservation no longer includes the project.
 
+    Args:
+        event.body.project_name (str): Name of the project to remove events from.
+        event.body.created_at (str): UTC datetime string of project creation.
+        event.body.event_id (str): id of the calendar event to remove.
+
+    Returns:
+        200 status code if calendar event was not associated with the project.
+        200 status code if successful removing the event id from the project.
+        400 status code if the request is malformed.
+        404 status code if the project does not exist.
+    """
+
+    try:
+        request_body = validate_request(event, "remove_project_event")
+    except ValidationError as e:
+        return bad_request(e)
+    table = get_table(projects_table)
+
+    print("event_body:")
+    print(request_body)
+
+    project_name = request_body["project_name"]
+    created_at = request_body["created_at"]
+    event_id = request_body["event_id"]  # ID of the calendar event
 
+    try:
+        previous_events = update_event_links(table, project_name, created_at, event_id, "DELETE")
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+            return create_response(404, "Project not found.")
+        raise
+
+    if event_id not in previous_events:
+        return create_response(200, 'Event was not associated with this project')
+    return create_response(200, 'Successfully removed event from project.')
+
+
+@capture_traffic
+@unavailable_when_throttled
 def addProjectData(event, context):
     """Updates a project with images taken to track the completion progress.
 
     When an observatory captures and uploads an image requested in a project,
     it should use this endpoint to update the project's completion status.
+    Sending the same base_filename again for an exposure has no effect, so
+    sites can safely retry a request that timed out.
 
     Args:
         event.body.project_name (str): Name of the existing project to modify.
@@ -432,11 +909,15 @@ def addProjectData(event, context):
 
     Returns:
         200 status code if project succesfully updates with image data.
+        400 status code if the request is malformed.
+        404 status code if the project does not exist.
         Otherwise, 500 status code if project does not unsuccessfully update.
     """
 
-    event_body = json.loads(event.get("body", ""))
-    table = dynamodb.Table(projects_table)
+    try:
+        event_body = validate_request(event, "add_project_data")
+    except ValidationError as e:
+        return bad_request(e)
 
     print("event")
     print(json.dumps(event))
@@ -451,49 +932,102 @@ def addProjectData(event, context):
     # Data to save
     base_filename = event_body["base_filename"]
 
-    # First, get the 'project_data' and 'remaining' arrays we want to update.
-    # 'project_data[exposure_index]' stores filenames of completed exposures.
-    # 'remaining[exposure_index]' is the number of exposures remaining.
-    resp1 = table.get_item(
-        Key={
-            "project_name": project_name,
-            "created_at": created_at,
-        }
-    ) 
-    project_data = resp1["Item"]["project_data"]
-    remaining = resp1["Item"]["remaining"]
+    try:
+        result = add_frames_to_project(project_name, created_at, [(exposure_index, base_filename)])
+    except ProjectUpdateConflict as e:
+        print(e)
+        return create_response(500, to_json({"message": "failed to update project in dynamodb"}))
+
+    if not result["project_exists"]:
+        return create_response(404, to_json({"message": "Project not found."}))
+    # The schema can only check the index is non-negative; the upper bound
+    # depends on how many exposures this project requested.
+    if result["out_of_range"]:
+        return bad_request(f"exposure_index {exposure_index} is out of range")
+    return create_response(200, to_json({"message": "success"}))
+
+
+@capture_traffic
+@unavailable_when_throttled
+def queueProjectData(event, context):
+    """Queues a completed image to be added to a project's progress.
+
+    This is the coalescing version of addProjectData, meant for sites taking
+    several frames a second for the same project. The frame report goes
+    into a durable buffer (an SQS queue) and the request returns right away.
+    processProjectDataQueue later adds all frames queued for a project in a
+    short window with a single update, so 'project_data' and 'remaining'
+    end up exactly as if each frame had been sent to addProjectData.
 
-    # Next, add our new information
-    project_data[exposure_index].append(base_filename)
-    remaining[exposure_index] = int(remaining[exposure_index]) - 1
+    Args:
+        event.body.project_name (str): Name of the existing project to modify.
+        event.body.created_at (str): UTC datetime string of project creation.
+        event.body.exposure_index (int):
+            Index of the most recently completed exposure.
+        event.body.base_filename (str):
+            New filename to add to the project's data.
+
+    Returns:
+        202 status code if the frame was queued.
+        400 status code if the request is malformed.
+    """
+
+    try:
+        event_body = validate_request(event, "add_project_data")
+    except ValidationError as e:
+        return bad_request(e)
+
+    get_frame_buffer().put({
+        "project_name": event_body["project_name"],
+        "created_at": event_body["created_at"],
+        "exposure_index": event_body["exposure_index"],
+        "base_filename": event_body["base_filename"],
+    })
+    return create_response(202, to_json({"message": "queued"}))
 
-    print("updated values: ")
-    print(project_data)
-    print(remaining)
-    
-    # Finally, update the DynamoDB project entry with 
-    # the revised 'project_data' and 'remaining'
-    resp2 = table.update_item(
-        Key={
-            "project_name": project_name,
-            "created_at": created_at,
-        },
-        UpdateExpression="SET #project_data = :project_data_updated, #remaining = :remaining_updated",
-        ExpressionAttributeNames={
-            "#project_data": "project_data",
-            "#remaining": "remaining",
-        },
-        ExpressionAttributeValues={
-            ":project_data_updated": project_data,
-            ":remaining_updated": remaining,
-        }
-    )
-    if resp2["ResponseMetadata"]["HTTPStatusCode"] == 200:
-        return create_response(200, json.dumps({"message": "success"}))
-    else:
-        return create_response(500, json.dumps({"message": "failed to update project in dynamodb"}))
 
+def processProjectDataQueue(event, context):
+    """Adds batches of queued frames to their projects.
+
+    Triggered by the project data SQS queue. Frames in the batch are grouped
+    by project, and each project gets one update via add_frames_to_project.
+    Frames for projects that could not be updated are reported back as
+    batch item failures, so SQS redelivers only those messages.
+
+    Frames for projects that no longer exist, or with an exposure_index the
+    project doesn't have, are dropped since retrying them can't succeed.
+
+    Args:
+        event.Records (list): SQS messages, each with a frame report body.
+
+    Returns:
+        dict: batchItemFailures listing the messageIds to retry.
+    """
 
+    failures = []
+    for (project_name, created_at), frames in fold_frames(event["Records"]).items():
+        try:
+            result = add_frames_to_project(
+                project_name, created_at,
+                [(exposure_index, base_filename) for _, exposure_index, base_filename in frames],
+            )
+        except Exception as e:
+            print(f"failed to add {len(frames)} frames to {project_name}#{created_at}: {e}")
+            failures.extend(message_id for message_id, _, _ in frames)
+            continue
+
+        if not result["project_exists"]:
+            print(f"dropping {len(frames)} frames for missing project {project_name}#{created_at}")
+        for exposure_index, base_filename in result["out_of_range"]:
+            print(f"dropping frame {base_filename}: exposure_index {exposure_index} is out of range")
+        print(f"added {len(result['added'])} frames to {project_name}#{created_at}, "
+              f"skipped {len(result['duplicates'])} duplicates")
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+
+@capture_traffic
+@unavailable_when_throttled
 def deleteProject(event, context):
     """Deletes a project from the DynamoDB table.
 
@@ -510,11 +1044,15 @@ def deleteProject(event, context):
 
     Returns:
         200 status code with successful projection deletion.
+        400 status code if the request is malformed.
         Otherwise, 403 status code if requesting user is unauthorized.
     """
     
-    request_body = json.loads(event.get("body", ""))
-    table = dynamodb.Table(projects_table)
+    try:
+        request_body = validate_request(event, "delete_project")
+    except ValidationError as e:
+        return bad_request(e)
+    table = get_table(projects_table)
 
     print("event")
     print(json.dumps(event))
@@ -543,7 +1081,7 @@ def deleteProject(event, context):
             "created_at": created_at
         },
     )
-    associated_events = event_response['Item']['scheduled_with_events']
+    associated_events = format_project(event_response['Item'])['scheduled_with_events']
 
     # Don't remove project from calendar events if the user is not authorized
     if requesterIsAdmin or userMakingThisRequest==event_response['Item']['user_id']:
@@ -565,6 +1103,7 @@ def deleteProject(event, context):
                 ":true": "true"
             }
         )
+        project_cache.invalidate((project_name, created_at))
     
     except ClientError as e:
         print(f"error deleting project: {e}")
@@ -573,16 +1112,30 @@ def deleteProject(event, context):
             return create_response(403, "You may only delete your own projects.")
         return create_response(403, e.response['Error']['Message'])
     
-    message = json.dumps(response, indent=4, cls=DecimalEncoder)
+    if wants_minimal_response(event):
+        message = to_json({
+            'project_name': project_name,
+            'created_at': created_at,
+            'status': 'deleted',
+        })
+    else:
+        message = to_json(response)
     print(f"success deleting project; message: {message}")
-    return create_response(200, message)
+    return create_response(200, message, event)
 
 
+@capture_traffic
+@unavailable_when_throttled
 def deleteSchedulerProjects(event, context):
     """Special delete method: intended only for clearing expired scheduler outputs
+
+    Deletes are rate limited, so a long list may not finish before the
+    Lambda times out. Once less than DELETE_TIME_MARGIN_MS remains, the
+    handler stops and returns the ids it didn't get to, which the caller
+    should send again.
     
     Args:
-        event.body.project_ids (list or str): IDs for all projects to delete.
+        event.body.project_ids (list): IDs for all projects to delete.
             Each ID is formatted {project_name}#{created_at}.
     
     Returns:
@@ -590,14 +1143,25 @@ def deleteSchedulerProjects(event, context):
             successful_delete_count: number of projects deleted successfully
             failed_delete_count: number of projects that failed to delete
             failed_ids: list of IDs for projects that failed to delete
+            unprocessed_ids: list of IDs not attempted before the time limit
+        400 status code if the request is malformed.
     """
-    request_body = json.loads(event.get("body", "{}"))
+    try:
+        request_body = validate_request(event, "delete_scheduler_projects")
+    except ValidationError as e:
+        return bad_request(e)
     
-    table = dynamodb.Table(projects_table)
+    table = get_table(projects_table)
     ids_to_delete = request_body.get("project_ids", [])
     failed_to_delete = []
-
-    for id in ids_to_delete:
+    unprocessed = []
+
+    for index, id in enumerate(ids_to_delete):
+        # context is None when called outside Lambda, eg. by replay.py.
+        if context is not None and context.get_remaining_time_in_millis() < DELETE_TIME_MARGIN_MS:
+            unprocessed = ids_to_delete[index:]
+            print(f"Stopping before the time limit with {len(unprocessed)} projects left to delete")
+            break
         project_name, created_at = id.split("#", 1)
         try:
             table.delete_item(
@@ -610,6 +1174,10 @@ def deleteSchedulerProjects(event, context):
                     ":scheduler_origin": "LCO"
                 }
             )
+            project_cache.invalidate((project_name, created_at))
+        except ThrottledError as e:
+            print(f"Error deleting project {id}: {e}")
+            failed_to_delete.append(id)
         except ClientError as e:
             error_code = e.response["Error"]["Code"]
             print(f"Error deleting project {id}: {e}")
@@ -618,9 +1186,10 @@ def deleteSchedulerProjects(event, context):
             failed_to_delete.append(id)
 
     response_message = {
-        "successful_delete_count": len(ids_to_delete) - len(failed_to_delete),
+        "successful_delete_count": len(ids_to_delete) - len(unprocessed) - len(failed_to_delete),
         "failed_delete_count": len(failed_to_delete),
         "failed_ids": failed_to_delete,
-        "message": "Delete finished"
+        "unprocessed_ids": unprocessed,
+        "message": "Delete stopped before the time limit" if unprocessed else "Delete finished"
     }
-    return create_response(200, json.dumps(response_message))
+    return create_response(200, to_json(response_message))
@@ -0,0 +1,392 @@
+"""Replays captured API traffic against the handlers, in-process.
+
+Traffic captured with TRAFFIC_CAPTURE (see traffic.py) is fed straight into
+the handler functions, using a local DynamoDB stand-in instead of the real
+table. This reproduces a real night's load on a laptop, so two builds can
+be compared before deploying.
+
+Start DynamoDB Local first, eg. with Docker:
+
+    docker run -p 8000:8000 amazon/dynamodb-local
+
+Then replay a capture at 10x speed with 8 concurrent requests:
+
+    python replay.py capture.jsonl --speedup 10 --concurrency 8 --create-table
+
+To replay against the projects that existed when the traffic was
+captured, export them from /get-all-projects at the start of the capture
+and pass the export with --projects, which loads it into the stand-in
+table first:
+
+    curl -X POST https://projects.photonranch.org/dev/get-all-projects > projects.json
+    python replay.py capture.jsonl --projects projects.json --create-table
+
+Without it, most requests find no project and only exercise the 400 and
+404 paths. Start each run from a fresh table, so earlier replays don't
+change the results.
+
+Latency percentiles and error rates are printed for each endpoint. Add
+--json to print them as JSON instead, to save and diff between builds.
+Latency is measured from when each request was due to be sent, not from
+when a worker picked it up, so time spent queued behind --concurrency is
+included. With --speedup 0 nothing has a due time, and latency is the
+handler's own run time.
+
+Use --throttle-rate to make a fraction of DynamoDB calls fail as throttled,
+to see how the retry and rate limiting in db.py hold up under load. The
+rate limits budget calls against DYNAMODB_READ_UNITS_PER_S and
+DYNAMODB_WRITE_UNITS_PER_S, which default to the deployed table's small
+capacity; raise them to replay against a bigger table.
+
+Calls to the calendar service are disabled during a replay. Frames sent
+to /queue-project-data are held in the local frame buffer and processed
+every --flush-interval seconds of replay time, and once more at the end.
+"""
+
+import argparse
+import decimal
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.awsrequest import AWSResponse
+
+from search import search_attributes
+from traffic import read_capture
+
+
+# Maps API paths (see serverless.yml) to handler function names.
+ROUTES = {
+    "/new-project": "addNewProject",
+    "/modify-project": "modify_project_handler",
+    "/get-project": "get_project_handler",
+    "/add-project-data": "addProjectData",
+    "/queue-project-data": "queueProjectData",
+    "/add-project-event": "addProjectEvent",
+    "/remove-project-event": "removeProjectEvent",
+    "/delete-project": "deleteProject",
+    "/delete-scheduler-projects": "deleteSchedulerProjects",
+    "/get-all-projects": "getAllProjects",
+    "/get-user-projects": "getUserProjects",
+    "/search-projects": "searchProjects",
+}
+
+
+def route_for(path):
+    """Returns the route for a captured path, which may include a base path."""
+    return "/" + (path or "").rstrip("/").split("/")[-1]
+
+
+def build_event(record):
+    """Rebuilds an API Gateway proxy event from a capture record."""
+
+    route = route_for(record["path"])
+    event = {
+        "httpMethod": record.get("method") or "POST",
+        "resource": route,
+        "path": route,
+        "headers": record.get("headers") or {},
+        "queryStringParameters": record.get("query"),
+        "body": record.get("body"),
+        "isBase64Encoded": record.get("is_base64_encoded", False),
+        "requestContext": {},
+    }
+    if record.get("authorizer") is not None:
+        event["requestContext"]["authorizer"] = record["authorizer"]
+    return event
+
+
+def percentile(sorted_values, fraction):
+    """Returns a percentile of already sorted values (nearest rank)."""
+
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def create_table(dynamodb, table_name):
+    """Creates a local copy of the projects table defined in serverless.yml."""
+
+    existing = [table.name for table in dynamodb.tables.all()]
+    if table_name in existing:
+        return
+    table = dynamodb.create_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {"AttributeName": "project_name", "AttributeType": "S"},
+            {"AttributeName": "created_at", "AttributeType": "S"},
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": "search_partition", "AttributeType": "S"},
+            {"AttributeName": "search_name", "AttributeType": "S"},
+        ],
+        KeySchema=[
+            {"AttributeName": "project_name", "KeyType": "HASH"},
+            {"AttributeName": "created_at", "KeyType": "RANGE"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "userid-createdat-index",
+                "KeySchema": [
+                    {"AttributeName": "user_id", "KeyType": "HASH"},
+                    {"AttributeName": "created_at", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+            {
+                "IndexName": "projectname-search-index",
+                "KeySchema": [
+                    {"AttributeName": "search_partition", "KeyType": "HASH"},
+                    {"AttributeName": "search_name", "KeyType": "RANGE"},
+                ],
+                "Projection": {
+                    "ProjectionType": "INCLUDE",
+                    "NonKeyAttributes": ["user_id", "project_sites"],
+                },
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    table.wait_until_exists()
+
+
+def seed_table(handler_module, table, projects):
+    """Loads projects exported from /get-all-projects into a table.
+
+    Args:
+        handler_module: the imported handler module.
+        table: boto3 Table to write to, bypassing the db module's rate limits.
+        projects (list): projects as returned by /get-all-projects.
+    """
+
+    with table.batch_writer() as batch:
+        for project in projects:
+            item = json.loads(json.dumps(project), parse_float=decimal.Decimal)
+            handler_module.store_event_links(item)
+            item.update(search_attributes(item["project_name"]))
+            batch.put_item(Item=item)
+
+
+def inject_throttling(client, rate, seed=None):
+    """Makes a fraction of DynamoDB calls fail as if they were throttled.
+
+    The error is returned by a botocore before-call hook, so the request is
+    never sent and the db module sees it exactly as it would a real
+    ProvisionedThroughputExceededException.
+
+    Args:
+        client: botocore DynamoDB client, eg. db.resource.meta.client.
+        rate (float): Fraction of calls to throttle, from 0 to 1.
+        seed (int): Optional seed, to throttle the same calls every run.
+    """
+
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def maybe_throttle(model, **kwargs):
+        with lock:
+            throttle = rng.random() < rate
+        if not throttle:
+            return None
+        parsed = {
+            "Error": {
+                "Code": "ProvisionedThroughputExceededException",
+                "Message": "Throttled by replay.py --throttle-rate",
+            },
+            "ResponseMetadata": {"HTTPStatusCode": 400},
+        }
+        return AWSResponse(None, 400, {}, None), parsed
+
+    client.meta.events.register("before-call.dynamodb", maybe_throttle)
+
+
+class Replay:
+    """Feeds capture records into the handlers and records the results."""
+
+    def __init__(self, handler_module, db_module, speedup, concurrency, flush_interval):
+        self.handler = handler_module
+        self.db = db_module
+        self.speedup = speedup
+        self.concurrency = concurrency
+        self.flush_interval = flush_interval
+        self.results = defaultdict(list)  # route -> [(status, latency_ms)]
+        self.captured_ms = defaultdict(list)  # route -> [original latency_ms]
+        self._lock = threading.Lock()
+
+    def _record(self, route, status, latency_ms):
+        with self._lock:
+            self.results[route].append((status, latency_ms))
+
+    def _call(self, route, event, due=None):
+        """Calls a handler and records its latency from the due time, if any."""
+
+        handler_function = getattr(self.handler, ROUTES[route])
+        start = time.perf_counter() if due is None else due
+        try:
+            status = handler_function(event, None).get("statusCode", 200)
+        except Exception as e:
+            print(f"{route} raised {type(e).__name__}: {e}", file=sys.stderr)
+            status = 500
+        self._record(route, status, (time.perf_counter() - start) * 1e3)
+
+    def flush_frames(self):
+        """Processes frames held in the local frame buffer, like the SQS consumer."""
+
+        records = self.handler.get_frame_buffer().drain()
+        if not records:
+            return
+        start = time.perf_counter()
+        response = self.handler.processProjectDataQueue({"Records": records}, None)
+        status = 500 if response["batchItemFailures"] else 200
+        self._record("(process-project-data-queue)", status, (time.perf_counter() - start) * 1e3)
+
+    def run(self, records):
+        skipped = 0
+        first_timestamp = records[0]["timestamp"] if records else 0
+        start = time.perf_counter()
+        last_flush = start
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in records:
+                route = route_for(record["path"])
+                if route not in ROUTES:
+                    skipped += 1
+                    continue
+                if "duration_ms" in record:
+                    self.captured_ms[route].append(record["duration_ms"])
+
+                due = None
+                if self.speedup > 0:
+                    due = start + (record["timestamp"] - first_timestamp) / self.speedup
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(self._call, route, build_event(record), due)
+
+                if time.perf_counter() - last_flush >= self.flush_interval:
+                    executor.submit(self.flush_frames)
+                    last_flush = time.perf_counter()
+
+        self.flush_frames()
+        if skipped:
+            print(f"skipped {skipped} records for unknown paths", file=sys.stderr)
+        return time.perf_counter() - start
+
+    def summary(self, elapsed_s):
+        endpoints = {}
+        for route, results in sorted(self.results.items()):
+            latencies = sorted(latency for _, latency in results)
+            captured = sorted(self.captured_ms.get(route, []))
+            endpoints[route] = {
+                "requests": len(results),
+                "error_rate_5xx": sum(1 for status, _ in results if status >= 500) / len(results),
+                "rate_4xx": sum(1 for status, _ in results if 400 <= status < 500) / len(results),
+                "p50_ms": percentile(latencies, 0.50),
+                "p90_ms": percentile(latencies, 0.90),
+                "p99_ms": percentile(latencies, 0.99),
+                "max_ms": latencies[-1],
+                "captured_p50_ms": percentile(captured, 0.50),
+            }
+        return {
+            "elapsed_s": elapsed_s,
+            "speedup": self.speedup,
+            "concurrency": self.concurrency,
+            "endpoints": endpoints,
+            "dynamodb": self.db.metrics_summary(),
+        }
+
+
+def print_summary(summary):
+    print(f"replayed in {summary['elapsed_s']:.1f} s "
+          f"(speedup {summary['speedup']}, concurrency {summary['concurrency']})")
+    header = f"{'endpoint':<32}{'reqs':>7}{'5xx':>8}{'4xx':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'orig p50':>10}"
+    print(header)
+    print("-" * len(header))
+
+    def ms(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    for route, stats in summary["endpoints"].items():
+        print(f"{route:<32}{stats['requests']:>7}"
+              f"{stats['error_rate_5xx']:>8.1%}{stats['rate_4xx']:>8.1%}"
+              f"{ms(stats['p50_ms']):>9}{ms(stats['p90_ms']):>9}"
+              f"{ms(stats['p99_ms']):>9}{ms(stats['max_ms']):>9}"
+              f"{ms(stats['captured_p50_ms']):>10}")
+    print("latencies in ms")
+
+    for name, operations in sorted(summary["dynamodb"].items()):
+        counts = ", ".join(f"{operation} {count}" for operation, count in sorted(operations.items()))
+        print(f"{name}: {counts}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured projects API traffic in-process.")
+    parser.add_argument("capture", help="capture file written with TRAFFIC_CAPTURE")
+    parser.add_argument("--speedup", type=float, default=1.0,
+                        help="replay this many times faster than captured; 0 replays as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="maximum number of requests handled at once")
+    parser.add_argument("--endpoint-url", default="http://localhost:8000",
+                        help="DynamoDB endpoint to use as the local stand-in")
+    parser.add_argument("--table", default="projects-replay",
+                        help="name of the table to use at the endpoint")
+    parser.add_argument("--create-table", action="store_true",
+                        help="create the table at the endpoint if it doesn't exist")
+    parser.add_argument("--projects",
+                        help="JSON export of /get-all-projects to load into the table first")
+    parser.add_argument("--flush-interval", type=float, default=5.0,
+                        help="seconds between processing frames sent to /queue-project-data")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="fraction of DynamoDB calls to fail with a throttling error")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed for --throttle-rate")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # handler.py reads its configuration at import time.
+    os.environ["PROJECTS_TABLE"] = args.table
+    os.environ["DYNAMODB_ENDPOINT_URL"] = args.endpoint_url
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("STAGE", "replay")
+    os.environ.pop("TRAFFIC_CAPTURE", None)
+    os.environ["PROJECT_DATA_QUEUE_URL"] = "local"
+    import db
+    import handler
+
+    # Never notify the real calendar service about replayed deletions.
+    handler.removeProjectFromCalendarEvents = lambda list_of_event_ids: None
+
+    if args.create_table:
+        create_table(db.resource, args.table)
+    if args.projects:
+        with open(args.projects) as projects_file:
+            projects = json.load(projects_file)
+        seed_table(handler, db.resource.Table(args.table), projects)
+        print(f"loaded {len(projects)} projects into {args.table}", file=sys.stderr)
+    if args.throttle_rate > 0:
+        inject_throttling(db.resource.meta.client, args.throttle_rate, args.seed)
+
+    records = read_capture(args.capture)
+    replay = Replay(handler, db, args.speedup, args.concurrency, args.flush_interval)
+    elapsed_s = replay.run(records)
+    summary = replay.summary(elapsed_s)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Name-prefix search index for projects.
+
+project_name is the table's hash key, so it can't be range-queried. To
+find projects by the start of their name, each project also stores:
+
+    search_partition  the same fixed value for every project
+    search_name       its name, normalized by normalize_name
+
+These are the hash and range keys of the projectname-search-index GSI, so
+a prefix search is a single Query with begins_with on search_name, and
+results come back sorted by name. addNewProject and modify_project keep
+the attributes up to date. DynamoDB doesn't allow empty key values, so a
+project whose name is only whitespace is left out of the index.
+
+The index is provisioned separately from the table, with enough read
+capacity for typeahead (see searchIndexReadCapacity in serverless.yml),
+and db.py budgets search queries against that capacity.
+
+Projects created before the index existed can be added to it with:
+
+    PROJECTS_TABLE=projects-dev python search.py
+"""
+
+import base64
+import json
+import os
+
+
+SEARCH_INDEX = "projectname-search-index"
+SEARCH_PARTITION = "project"
+
+# Attributes only used by the index, which are left out of API responses.
+SEARCH_ATTRIBUTES = ("search_partition", "search_name")
+
+# Keys of the index's LastEvaluatedKey: its own keys and the table's.
+PAGE_TOKEN_KEYS = {"search_partition", "search_name", "project_name", "created_at"}
+
+
+class InvalidPageToken(Exception):
+    """Raised when a search page token can't be decoded."""
+
+
+def normalize_name(name):
+    """Normalizes a project name for case-insensitive matching."""
+    return " ".join(name.split()).casefold()
+
+
+def normalize_prefix(prefix):
+    """Normalizes a search prefix like a name, keeping one trailing space.
+
+    The trailing space matters while typing: "m31 " should only match names
+    with another word after "m31", not "m31a".
+    """
+
+    normalized = normalize_name(prefix)
+    if normalized and prefix[-1:].isspace():
+        normalized += " "
+    return normalized
+
+
+def search_attributes(project_name):
+    """Returns the index attributes to store with a project.
+
+    Returns an empty dict if the normalized name is empty, which would be
+    rejected as an index key.
+    """
+
+    search_name = normalize_name(project_name)
+    if not search_name:
+        return {}
+    return {
+        "search_partition": SEARCH_PARTITION,
+        "search_name": search_name,
+    }
+
+
+def encode_page_token(last_evaluated_key):
+    """Turns a query's LastEvaluatedKey into an opaque page token."""
+
+    if not last_evaluated_key:
+        return None
+    data = json.dumps(last_evaluated_key, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_page_token(page_token):
+    """Turns a page token back into an ExclusiveStartKey."""
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(page_token.encode("ascii")))
+    except (TypeError, ValueError):
+        raise InvalidPageToken("page_token is not valid")
+    if (not isinstance(key, dict)
+            or set(key) != PAGE_TOKEN_KEYS
+            or not all(isinstance(value, str) and value for value in key.values())
+            or key["search_partition"] != SEARCH_PARTITION):
+        raise InvalidPageToken("page_token is not valid")
+    return key
+
+
+def backfill(table):
+    """Adds the search attributes to every project that is missing them.
+
+    Args:
+        table: db.ThrottledTable for the projects table.
+
+    Returns:
+        int: number of projects updated.
+    """
+
+    updated = 0
+    scan_kwargs = {"ProjectionExpression": "project_name, created_at, search_name"}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response["Items"]:
+            attributes = search_attributes(item["project_name"])
+            if not attributes or item.get("search_name") == attributes["search_name"]:
+                continue
+            table.update_item(
+                Key={
+                    "project_name": item["project_name"],
+                    "created_at": item["created_at"],
+                },
+                UpdateExpression="SET search_partition = :partition, search_name = :name",
+                ConditionExpression="attribute_exists(project_name)",
+                ExpressionAttributeValues={
+                    ":partition": attributes["search_partition"],
+                    ":name": attributes["search_name"],
+                },
+            )
+            updated += 1
+        if "LastEvaluatedKey" not in response:
+            return updated
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+if __name__ == "__main__":
+    from db import get_table
+    print(f"updated {backfill(get_table(os.environ['PROJECTS_TABLE']))} projects")
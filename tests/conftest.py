@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The handlers are flat modules at the repository root, and read their
+# configuration from the environment when they are imported.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROJECTS_TABLE", "projects-test")
+os.environ.setdefault("STAGE", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+@pytest.fixture
+def projects_table(monkeypatch):
+    """A projects table in a moto stand-in, used by every handler."""
+
+    moto = pytest.importorskip("moto")
+    import boto3
+    import handler
+    from db import ThrottledTable
+    from replay import create_table
+
+    with moto.mock_aws():
+        resource = boto3.resource("dynamodb")
+        create_table(resource, "projects-test")
+        table = ThrottledTable(resource.Table("projects-test"))
+        monkeypatch.setattr(handler, "get_table", lambda table_name: table)
+        yield table
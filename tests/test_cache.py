@@ -0,0 +1,67 @@
+"""Tests for the in-process project cache."""
+
+from cache import ProjectCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_put_after_invalidation_is_dropped():
+    cache = ProjectCache(ttl_s=60)
+
+    version = cache.version("m31")
+    cache.invalidate("m31")  # a write lands while the read is in flight
+    cache.put("m31", "stale", version)
+    assert cache.get("m31") is None
+
+    cache.put("m31", "fresh", cache.version("m31"))
+    assert cache.get("m31") == "fresh"
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ProjectCache(ttl_s=5, clock=clock)
+
+    cache.put("m31", "project", cache.version("m31"))
+    clock.now = 4.9
+    assert cache.get("m31") == "project"
+    clock.now = 5.0
+    assert cache.get("m31") is None
+
+
+def test_invalidations_are_pruned_to_the_cache_size():
+    cache = ProjectCache(ttl_s=60, max_size=2)
+
+    cache.put("m31", "project", cache.version("m31"))
+    for key in ("m42", "m51", "m101"):
+        cache.invalidate(key)
+    assert len(cache._invalidations) == 2
+
+    # m31 was read before a pruned invalidation, so it can't be trusted.
+    assert cache.get("m31") is None
+
+
+def test_put_is_dropped_after_its_invalidation_is_pruned():
+    cache = ProjectCache(ttl_s=60, max_size=1)
+
+    version = cache.version("m31")
+    cache.invalidate("m31")
+    cache.invalidate("m42")  # prunes the record of m31's invalidation
+    cache.put("m31", "stale", version)
+    assert cache.get("m31") is None
+
+
+def test_disabled_cache_keeps_no_state():
+    cache = ProjectCache(ttl_s=0)
+
+    for index in range(1000):
+        cache.invalidate(("project", index))
+    cache.put("m31", "project", cache.version("m31"))
+    assert cache.get("m31") is None
+    assert len(cache._invalidations) == 0
+    assert cache.stats()["size"] == 0
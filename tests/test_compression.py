@@ -0,0 +1,57 @@
+"""Tests for response compression and its API Gateway configuration."""
+
+import os
+
+import pytest
+
+from compression import negotiate_encoding
+
+
+SERVERLESS_YML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serverless.yml")
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("gzip", "gzip"),
+    ("identity", None),
+    ("gzip;q=0.5", "gzip"),
+    ("*", "gzip"),
+    ("gzip;q=0, *", None),
+    ("*, gzip;q=0", None),
+    ("*;q=0, gzip", "gzip"),
+    ("GZIP;Q=0, *", None),
+])
+def test_negotiate_encoding(accept_encoding, expected, monkeypatch):
+    monkeypatch.setattr("compression.SUPPORTED_ENCODINGS", ("gzip",))
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def preflight_logical_id(path):
+    """Returns the logical id serverless gives the OPTIONS method of a path."""
+
+    words = path.replace("-", "Dash").split("/")
+    return "ApiGatewayMethod" + "".join(word[:1].upper() + word[1:] for word in words) + "Options"
+
+
+def test_binary_media_types_come_with_text_preflights():
+    """Every CORS preflight needs CONVERT_TO_TEXT once binaryMediaTypes is set.
+
+    Without it the OPTIONS mock integration fails, and the browser UI can't
+    call the endpoint.
+    """
+
+    yaml = pytest.importorskip("yaml")
+    with open(SERVERLESS_YML) as config_file:
+        config = yaml.safe_load(config_file)
+    if not (config["provider"].get("apiGateway") or {}).get("binaryMediaTypes"):
+        return
+
+    extensions = (config.get("resources") or {}).get("extensions") or {}
+    for function in config["functions"].values():
+        for event in function.get("events", []):
+            http = event.get("http")
+            if not http or not http.get("cors"):
+                continue
+            logical_id = preflight_logical_id(http["path"])
+            integration = extensions.get(logical_id, {}).get("Properties", {}).get("Integration", {})
+            assert integration.get("ContentHandling") == "CONVERT_TO_TEXT", logical_id
@@ -0,0 +1,181 @@
+"""Tests for project writes against a moto stand-in (see conftest.py)."""
+
+import json
+
+import pytest
+
+import frame_buffer
+import handler
+from frame_buffer import fold_frames
+
+
+KEY = {"project_name": "m31", "created_at": "2022-01-01"}
+
+
+def call(handler_function, body, context=None):
+    response = handler_function({"body": json.dumps(body)}, context)
+    return response["statusCode"], response["body"]
+
+
+def new_project(exposure_counts=(3,)):
+    body = {
+        **KEY,
+        "user_id": "user",
+        "exposures": [{"count": str(count), "exposure": "30"} for count in exposure_counts],
+        "remaining": [str(count) for count in exposure_counts],
+        "project_data": [[] for _ in exposure_counts],
+    }
+    assert call(handler.addNewProject, body)[0] == 200
+    return body
+
+
+def stored_project(table):
+    return table.get_item(Key=KEY)["Item"]
+
+
+def test_modify_project_keeps_stored_event_links(projects_table):
+    project = new_project()
+    assert call(handler.addProjectEvent, {**KEY, "event_id": "e1"})[0] == 200
+
+    # The client's copy was read before e1 was linked.
+    changes = {
+        "project_name": "m31",
+        "project_constraints": {},
+        "project_note": "changed",
+        "project_targets": [],
+        "project_sites": [],
+        "scheduled_with_events": [],
+        "project_priority": "standard",
+        "exposures": project["exposures"],
+    }
+    assert call(handler.modify_project_handler, {**KEY, "project_changes": changes})[0] == 200
+
+    stored = stored_project(projects_table)
+    assert stored["project_note"] == "changed"
+    assert stored["scheduled_with_events"] == {"e1"}
+
+
+def frame_record(message_id, exposure_index, base_filename, key=KEY):
+    return {
+        "messageId": message_id,
+        "body": json.dumps({**key, "exposure_index": exposure_index, "base_filename": base_filename}),
+    }
+
+
+def test_frames_are_added_once_each(projects_table):
+    new_project(exposure_counts=(3, 2))
+
+    result = handler.add_frames_to_project(
+        KEY["project_name"], KEY["created_at"],
+        [(0, "f1"), (1, "f2"), (0, "f1"), (2, "f3")],
+    )
+
+    assert result["added"] == [(0, "f1"), (1, "f2")]
+    assert result["duplicates"] == [(0, "f1")]
+    assert result["out_of_range"] == [(2, "f3")]
+    stored = stored_project(projects_table)
+    assert stored["project_data"] == [["f1"], ["f2"]]
+    assert stored["remaining"] == [2, 1]
+
+
+def test_concurrent_write_is_retried_without_losing_frames(projects_table, monkeypatch):
+    new_project(exposure_counts=(3,))
+    update_item = projects_table.update_item
+    raced = []
+
+    def update_after_another_writer(**kwargs):
+        # Another writer adds a frame between our read and our write.
+        if not raced:
+            raced.append(True)
+            handler.add_frames_to_project(KEY["project_name"], KEY["created_at"], [(0, "other")])
+        return update_item(**kwargs)
+
+    monkeypatch.setattr(projects_table, "update_item", update_after_another_writer)
+    result = handler.add_frames_to_project(KEY["project_name"], KEY["created_at"], [(0, "mine")])
+
+    assert result["added"] == [(0, "mine")]
+    stored = stored_project(projects_table)
+    assert stored["project_data"] == [["other", "mine"]]
+    assert stored["remaining"] == [1]
+
+
+def test_update_gives_up_after_repeated_conflicts(projects_table, monkeypatch):
+    new_project(exposure_counts=(3,))
+    update_item = projects_table.update_item
+    writes = []
+
+    def always_raced(**kwargs):
+        writes.append(True)
+        projects_table.table.update_item(
+            Key=KEY,
+            UpdateExpression="SET project_note = :note, #remaining = :remaining",
+            ExpressionAttributeNames={"#remaining": "remaining"},
+            ExpressionAttributeValues={":note": str(len(writes)), ":remaining": [len(writes)]},
+        )
+        return update_item(**kwargs)
+
+    monkeypatch.setattr(projects_table, "update_item", always_raced)
+    with pytest.raises(handler.ProjectUpdateConflict):
+        handler.add_frames_to_project(KEY["project_name"], KEY["created_at"], [(0, "f1")], max_attempts=3)
+    assert len(writes) == 3
+
+
+def test_fold_frames_groups_by_project_in_order():
+    other = {"project_name": "m42", "created_at": "2022-02-01"}
+    records = [
+        frame_record("a", 0, "f1"),
+        frame_record("b", 0, "g1", key=other),
+        frame_record("c", 1, "f2"),
+    ]
+
+    folded = fold_frames(records)
+
+    assert list(folded) == [("m31", "2022-01-01"), ("m42", "2022-02-01")]
+    assert folded[("m31", "2022-01-01")] == [("a", 0, "f1"), ("c", 1, "f2")]
+
+
+def test_queue_consumer_reports_failures_and_ignores_redelivery(projects_table, monkeypatch):
+    new_project(exposure_counts=(3,))
+    failing = {"project_name": "m42", "created_at": "2022-02-01"}
+    records = [
+        frame_record("a", 0, "f1"),
+        frame_record("b", 0, "f2"),
+        frame_record("c", 0, "g1", key=failing),
+        frame_record("d", 5, "f3"),
+        frame_record("e", 0, "h1", key={"project_name": "gone", "created_at": "2022"}),
+    ]
+    add_frames_to_project = handler.add_frames_to_project
+
+    def fail_for_m42(project_name, created_at, frames):
+        if project_name == "m42":
+            raise handler.ProjectUpdateConflict("raced")
+        return add_frames_to_project(project_name, created_at, frames)
+
+    monkeypatch.setattr(handler, "add_frames_to_project", fail_for_m42)
+    response = handler.processProjectDataQueue({"Records": records}, None)
+
+    # Only the failed project's messages are retried; out of range frames
+    # and frames for missing projects are dropped.
+    assert response == {"batchItemFailures": [{"itemIdentifier": "c"}]}
+    assert stored_project(projects_table)["remaining"] == [1]
+
+    # SQS may deliver the same messages again.
+    handler.processProjectDataQueue({"Records": records[:2]}, None)
+    stored = stored_project(projects_table)
+    assert stored["project_data"] == [["f1", "f2"]]
+    assert stored["remaining"] == [1]
+
+
+def test_frame_buffer_must_be_configured(monkeypatch):
+    monkeypatch.setattr(frame_buffer, "_frame_buffer", None)
+    monkeypatch.delenv("PROJECT_DATA_QUEUE_URL", raising=False)
+    with pytest.raises(RuntimeError):
+        frame_buffer.get_frame_buffer()
+
+    monkeypatch.setenv("PROJECT_DATA_QUEUE_URL", frame_buffer.LOCAL_QUEUE_URL)
+    buffer = frame_buffer.get_frame_buffer()
+    assert isinstance(buffer, frame_buffer.LocalFrameBuffer)
+
+    buffer.put({**KEY, "exposure_index": 0, "base_filename": "f1"})
+    assert [json.loads(record["body"])["base_filename"] for record in buffer.drain()] == ["f1"]
+    assert len(buffer) == 0
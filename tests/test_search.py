@@ -0,0 +1,62 @@
+"""Tests for project search with blank names and malformed page tokens."""
+
+import base64
+import json
+
+import pytest
+
+import handler
+import search
+
+
+def page_token(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def test_blank_names_are_left_out_of_the_index():
+    assert search.search_attributes(" \t ") == {}
+    assert search.search_attributes(" M31  Andromeda ")["search_name"] == "m31 andromeda"
+
+
+def test_project_with_blank_name_is_stored_but_not_searchable(projects_table):
+    body = {"project_name": "   ", "user_id": "user", "created_at": "2022-01-01"}
+
+    response = handler.addNewProject({"body": json.dumps(body)}, None)
+    assert response["statusCode"] == 200
+
+    response = handler.searchProjects({"body": json.dumps({"prefix": ""})}, None)
+    assert json.loads(response["body"])["projects"] == []
+
+
+def test_search_pages_through_results(projects_table):
+    for name in ("M31", "m32", "M33"):
+        body = {"project_name": name, "user_id": "user", "created_at": "2022-01-01"}
+        handler.addNewProject({"body": json.dumps(body)}, None)
+
+    names = []
+    request = {"prefix": "m3", "limit": 2}
+    while True:
+        response = handler.searchProjects({"body": json.dumps(request)}, None)
+        result = json.loads(response["body"])
+        names.extend(project["project_name"] for project in result["projects"])
+        if not result["next_page_token"]:
+            break
+        request["page_token"] = result["next_page_token"]
+    assert names == ["M31", "m32", "M33"]
+
+
+@pytest.mark.parametrize("token", [
+    "not base64 json",
+    page_token(["project"]),
+    page_token({"search_partition": "project"}),
+    page_token({"search_partition": "project", "search_name": "m31", "project_name": "M31"}),
+    page_token({"search_partition": "project", "search_name": "m31",
+                "project_name": "M31", "created_at": 5}),
+    page_token({"search_partition": "other", "search_name": "m31",
+                "project_name": "M31", "created_at": "2022-01-01"}),
+    page_token({"search_partition": "project", "search_name": "m31",
+                "project_name": "M31", "created_at": "2022-01-01", "extra": "x"}),
+])
+def test_malformed_page_tokens_are_rejected(token):
+    with pytest.raises(search.InvalidPageToken):
+        search.decode_page_token(token)
@@ -0,0 +1,296 @@
+"""Tests for the retry and rate limiting in db.py, with throttling injected."""
+
+import json
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import db
+import handler
+
+
+def throttling_error(operation="GetItem"):
+    return ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "throttled"}},
+        operation,
+    )
+
+
+class FakeTable:
+    """Stands in for a boto3 Table.
+
+    A ClientError in errors is raised on every call, like a table that stays
+    throttled. Other errors are raised once each, before calls succeed.
+    """
+
+    name = "projects-test"
+
+    def __init__(self, errors=(), item=None):
+        self.errors = list(errors)
+        self.item = item
+        self.calls = 0
+
+    def _respond(self, response):
+        self.calls += 1
+        if self.errors:
+            error = self.errors[0]
+            if not isinstance(error, ClientError):
+                self.errors.pop(0)
+            raise error
+        return response
+
+    def get_item(self, **kwargs):
+        return self._respond({"Item": self.item} if self.item else {})
+
+    def delete_item(self, **kwargs):
+        return self._respond({})
+
+
+class CapacityReportingTable:
+    """Stands in for a boto3 Table that reports the capacity of each call."""
+
+    name = "projects-test"
+
+    def __init__(self, consumed):
+        self.consumed = consumed
+        self.calls = []
+
+    def _respond(self, operation, kwargs):
+        self.calls.append((operation, kwargs))
+        return {"Items": [], "ConsumedCapacity": self.consumed}
+
+    def scan(self, **kwargs):
+        return self._respond("Scan", kwargs)
+
+    def query(self, **kwargs):
+        return self._respond("Query", kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._respond("DeleteItem", kwargs)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def throttled_table(fake_table, max_attempts=4):
+    sleeps = []
+    table = db.ThrottledTable(
+        fake_table,
+        max_attempts=max_attempts,
+        reads=db.TokenBucket(rate=1000, burst=1000),
+        writes=db.TokenBucket(rate=1000, burst=1000),
+        sleep=sleeps.append,
+    )
+    return table, sleeps
+
+
+def test_throttled_call_is_retried_then_raises_throttled_error():
+    fake_table = FakeTable(errors=[throttling_error()])
+    table, sleeps = throttled_table(fake_table, max_attempts=4)
+
+    with pytest.raises(db.ThrottledError):
+        table.get_item(Key={"project_name": "m31", "created_at": "2022"})
+
+    assert fake_table.calls == 4
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= table.max_delay_s for delay in sleeps)
+
+
+def test_connection_errors_are_retried():
+    fake_table = FakeTable(
+        errors=[EndpointConnectionError(endpoint_url="http://localhost")],
+        item={"project_name": "m31"},
+    )
+    table, sleeps = throttled_table(fake_table)
+
+    assert table.get_item(Key={})["Item"] == {"project_name": "m31"}
+    assert fake_table.calls == 2
+    assert len(sleeps) == 1
+
+
+def test_other_client_errors_are_not_retried():
+    error = ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "GetItem")
+    fake_table = FakeTable(errors=[error])
+    table, sleeps = throttled_table(fake_table)
+
+    with pytest.raises(ClientError):
+        table.get_item(Key={})
+    assert fake_table.calls == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("handler_name, body", [
+    ("get_project_handler", {"project_name": "m31", "created_at": "2022"}),
+    ("modify_project_handler", {
+        "project_name": "m31",
+        "created_at": "2022",
+        "project_changes": {
+            "project_name": "m31",
+            "project_constraints": {},
+            "project_note": "",
+            "project_targets": [],
+            "project_sites": [],
+            "scheduled_with_events": [],
+            "project_priority": "standard",
+            "exposures": [{"count": "3", "exposure": "30"}],
+        },
+    }),
+])
+def test_handlers_return_503_when_throttled(monkeypatch, handler_name, body):
+    table, _ = throttled_table(FakeTable(errors=[throttling_error()]))
+    monkeypatch.setattr(handler, "get_table", lambda table_name: table)
+
+    response = getattr(handler, handler_name)({"body": json.dumps(body)}, None)
+
+    assert response["statusCode"] == 503
+    assert response["headers"]["Retry-After"] == "1"
+
+
+def test_scheduler_deletes_stop_before_the_time_limit(monkeypatch):
+    class FakeContext:
+        def __init__(self, remaining_ms):
+            self.remaining_ms = list(remaining_ms)
+
+        def get_remaining_time_in_millis(self):
+            return self.remaining_ms.pop(0)
+
+    fake_table = FakeTable()
+    table, _ = throttled_table(fake_table)
+    monkeypatch.setattr(handler, "get_table", lambda table_name: table)
+    body = {"project_ids": ["m31#2022-01", "m42#2022-02", "m51#2022-03"]}
+    context = FakeContext([20000, handler.DELETE_TIME_MARGIN_MS - 1])
+
+    response = handler.deleteSchedulerProjects({"body": json.dumps(body)}, context)
+
+    result = json.loads(response["body"])
+    assert fake_table.calls == 1
+    assert result["successful_delete_count"] == 1
+    assert result["unprocessed_ids"] == ["m42#2022-02", "m51#2022-03"]
+
+
+def capacity_table(consumed):
+    clock = FakeClock()
+    buckets = {
+        name: db.TokenBucket(rate=1, burst=10, clock=clock, sleep=clock.sleep)
+        for name in ("reads", "writes", "search")
+    }
+    fake_table = CapacityReportingTable(consumed)
+    table = db.ThrottledTable(
+        fake_table,
+        reads=buckets["reads"],
+        writes=buckets["writes"],
+        index_reads={"search-index": buckets["search"]},
+    )
+    return table, fake_table, buckets, clock
+
+
+def test_scans_read_small_pages_and_are_charged_their_capacity():
+    table, fake_table, buckets, clock = capacity_table({
+        "TableName": "projects-test",
+        "CapacityUnits": 8.5,
+        "Table": {"CapacityUnits": 8.5},
+    })
+
+    response = table.scan()
+
+    operation, kwargs = fake_table.calls[0]
+    assert kwargs["Limit"] == db.SCAN_PAGE_SIZE
+    assert kwargs["ReturnConsumedCapacity"] == "INDEXES"
+    assert "ConsumedCapacity" not in response
+    assert buckets["reads"]._tokens == pytest.approx(10 - 8.5)
+    assert buckets["writes"]._tokens == 10
+
+    # A scan that used more than the bucket holds makes the next call wait.
+    table.scan()
+    assert buckets["reads"]._tokens < 0
+    table.scan()
+    # 1.5 - 8.5 leaves -7 tokens, so the next unit takes 8 s at 1 unit/s.
+    assert clock.sleeps == [pytest.approx(8)]
+
+
+def test_writes_are_charged_the_table_share_only():
+    table, fake_table, buckets, _ = capacity_table({
+        "TableName": "projects-test",
+        "CapacityUnits": 3,
+        "Table": {"CapacityUnits": 2},
+        "GlobalSecondaryIndexes": {"search-index": {"CapacityUnits": 1}},
+    })
+
+    table.delete_item(Key={"project_name": "m31", "created_at": "2022"})
+
+    assert buckets["writes"]._tokens == pytest.approx(8)
+    assert buckets["reads"]._tokens == 10
+
+
+def test_index_queries_use_the_index_budget():
+    table, fake_table, buckets, _ = capacity_table({
+        "TableName": "projects-test",
+        "CapacityUnits": 0.5,
+        "GlobalSecondaryIndexes": {"search-index": {"CapacityUnits": 0.5}},
+    })
+
+    table.query(IndexName="search-index", KeyConditionExpression="ignored")
+
+    assert buckets["search"]._tokens == pytest.approx(9.5)
+    assert buckets["reads"]._tokens == 10
+
+
+def test_token_bucket_halves_on_throttle_and_recovers():
+    clock = FakeClock()
+    bucket = db.TokenBucket(rate=8, burst=1, min_rate=1, clock=clock, sleep=clock.sleep)
+
+    bucket.on_throttle()
+    assert bucket.rate == 4
+    for _ in range(5):
+        bucket.on_throttle()
+    assert bucket.rate == 1
+
+    # Each success recovers a twentieth of the maximum rate, up to the maximum.
+    bucket.on_success()
+    assert bucket.rate == pytest.approx(1.4)
+    for _ in range(50):
+        bucket.on_success()
+    assert bucket.rate == 8
+
+
+def test_token_bucket_waits_at_its_current_rate():
+    clock = FakeClock()
+    bucket = db.TokenBucket(rate=4, burst=1, clock=clock, sleep=clock.sleep)
+
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+    bucket.on_throttle()
+    bucket.acquire()
+    assert clock.sleeps[-1] == pytest.approx(0.5)
+
+
+def test_injected_throttling_against_local_stand_in():
+    moto = pytest.importorskip("moto")
+    import boto3
+    from botocore.config import Config
+    from replay import create_table, inject_throttling
+
+    with moto.mock_aws():
+        resource = boto3.resource(
+            "dynamodb", config=Config(retries={"mode": "standard", "max_attempts": 1}),
+        )
+        create_table(resource, "projects-test")
+        inject_throttling(resource.meta.client, rate=1.0)
+        table, sleeps = throttled_table(resource.Table("projects-test"), max_attempts=3)
+
+        with pytest.raises(db.ThrottledError):
+            table.get_item(Key={"project_name": "m31", "created_at": "2022"})
+        assert len(sleeps) == 2
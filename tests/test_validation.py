@@ -0,0 +1,39 @@
+"""Tests for the request schemas in validation.py."""
+
+import pytest
+
+from validation import ValidationError, validate_body
+
+
+NEW_PROJECT = {"project_name": "m31", "user_id": "user", "created_at": "2022-01-01"}
+
+
+@pytest.mark.parametrize("remaining", [["1.5"], ["nan"], ["inf"], [1.5], [True]])
+def test_remaining_must_be_integers(remaining):
+    with pytest.raises(ValidationError):
+        validate_body("new_project", {**NEW_PROJECT, "remaining": remaining})
+
+
+def test_exposure_lists_must_have_the_same_length():
+    body = {
+        **NEW_PROJECT,
+        "exposures": [{"count": "3", "exposure": "30"}],
+        "remaining": ["3"],
+        "project_data": [[]],
+    }
+    validate_body("new_project", body)
+
+    with pytest.raises(ValidationError):
+        validate_body("new_project", {**body, "remaining": ["3", "3"]})
+
+
+@pytest.mark.parametrize("exposure", [{"exposure": "30"}, {"count": "3.5"}, {"count": "3", "exposure": "nan"}])
+def test_malformed_exposures_are_rejected(exposure):
+    with pytest.raises(ValidationError):
+        validate_body("new_project", {**NEW_PROJECT, "exposures": [exposure]})
+
+
+def test_scheduler_project_ids_need_a_separator():
+    validate_body("delete_scheduler_projects", {"project_ids": ["m31#2022-01-01"]})
+    with pytest.raises(ValidationError):
+        validate_body("delete_scheduler_projects", {"project_ids": ["m31"]})
@@ -0,0 +1,121 @@
+"""Optional capture of API traffic for later replay with replay.py.
+
+Handlers decorated with capture_traffic record one JSON line per request
+when the TRAFFIC_CAPTURE environment variable is set:
+
+    TRAFFIC_CAPTURE=stdout         print each record to the Lambda log,
+                                   prefixed with CAPTURE_PREFIX, so it can
+                                   be exported from CloudWatch.
+    TRAFFIC_CAPTURE=/path/to/file  append each record to a local file.
+
+When TRAFFIC_CAPTURE is unset the decorator just calls the handler.
+
+Each record holds what is needed to rebuild the API Gateway event, and
+how the original request went:
+
+    {
+        "timestamp": 1657000000.123,   # epoch seconds the request started
+        "method": "POST",
+        "path": "/add-project-data",
+        "headers": {"Accept-Encoding": "gzip"},
+        "query": null,
+        "body": "{...}",
+        "is_base64_encoded": false,
+        "authorizer": null,            # requestContext.authorizer, if any
+        "status": 200,
+        "duration_ms": 41.7
+    }
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+
+CAPTURE_PREFIX = "TRAFFIC_CAPTURE "
+
+# Only headers that change how a request is handled are recorded.
+CAPTURED_HEADERS = ("accept-encoding", "prefer", "content-type")
+
+_write_lock = threading.Lock()
+
+
+def _captured_headers(event):
+    headers = event.get("headers") or {}
+    return {key: value for key, value in headers.items() if key.lower() in CAPTURED_HEADERS}
+
+
+def _write_record(target, record):
+    line = json.dumps(record, separators=(",", ":"))
+    if target == "stdout":
+        print(CAPTURE_PREFIX + line)
+        return
+    with _write_lock:
+        with open(target, "a") as capture_file:
+            capture_file.write(line + "\n")
+
+
+def capture_traffic(handler):
+    """Decorates an API handler to record its requests when enabled."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        target = os.environ.get("TRAFFIC_CAPTURE")
+        if not target:
+            return handler(event, context)
+
+        timestamp = time.time()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = handler(event, context)
+            status = response.get("statusCode", 200)
+            return response
+        finally:
+            record = {
+                "timestamp": timestamp,
+                "method": event.get("httpMethod"),
+                "path": event.get("resource") or event.get("path"),
+                "headers": _captured_headers(event),
+                "query": event.get("queryStringParameters"),
+                "body": event.get("body"),
+                "is_base64_encoded": bool(event.get("isBase64Encoded")),
+                "authorizer": (event.get("requestContext") or {}).get("authorizer"),
+                "status": status,
+                "duration_ms": round((time.perf_counter() - start) * 1e3, 3),
+            }
+            try:
+                _write_record(target, record)
+            except Exception as e:
+                # Capturing must never break the request itself.
+                print(f"failed to capture request: {e}")
+
+    return wrapper
+
+
+def read_capture(path):
+    """Reads capture records from a file, sorted by timestamp.
+
+    Accepts files written with TRAFFIC_CAPTURE=/path, and CloudWatch log
+    exports where each record follows CAPTURE_PREFIX on its own line.
+    Lines that aren't capture records are skipped.
+    """
+
+    records = []
+    with open(path) as capture_file:
+        for line in capture_file:
+            if CAPTURE_PREFIX in line:
+                line = line.split(CAPTURE_PREFIX, 1)[1]
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "path" in record and "timestamp" in record:
+                records.append(record)
+    records.sort(key=lambda record: record["timestamp"])
+    return records
@@ -0,0 +1,317 @@
+"""Request body validation for the projects API handlers.
+
+Each endpoint has a schema describing the keys and types its request body
+must contain. Schemas are compiled into plain Python check functions once,
+when this module is first imported, so a warm Lambda container only pays
+for a single pass over the request body.
+
+Handlers should validate before making any DynamoDB calls, so that a
+malformed request is rejected without consuming any table capacity.
+"""
+
+import base64
+import json
+import math
+
+
+class ValidationError(Exception):
+    """Raised when a request body does not match its endpoint schema."""
+
+
+#=========================================#
+#=======     Schema Compilation     ======#
+#=========================================#
+
+# Each schema node is a dict with a "type" and type-specific options:
+#   "str"          plain string. Options: "nonempty" (bool), "contains"
+#                  (a substring the value must include).
+#   "int"          integer (bools are rejected). Options: "min", "max" (int).
+#   "bool"         boolean.
+#   "number"       a finite number, or a string that parses as one.
+#                  Projects store exposure times as strings (eg. "30").
+#   "integer"      an integer, or a string of digits with an optional '-'
+#                  (eg. "30"). Counts and 'remaining' are stored as strings
+#                  but parsed with int() when frames are added.
+#   "any"          anything json-serializable.
+#   "list"         Options: "items" (schema node for every element).
+#   "dict"         Options: "keys" (dict of key -> schema node),
+#                  "required" (list of keys that must be present),
+#                  "same_length" (list of keys whose lists, when present,
+#                  must all have the same length).
+
+def _describe(path):
+    return path or "request body"
+
+
+def _compile_str(node):
+    nonempty = node.get("nonempty", False)
+    contains = node.get("contains")
+
+    def check(value, path):
+        if not isinstance(value, str):
+            raise ValidationError(f"{_describe(path)} must be a string")
+        if nonempty and not value:
+            raise ValidationError(f"{_describe(path)} must not be empty")
+        if contains is not None and contains not in value:
+            raise ValidationError(f"{_describe(path)} must contain '{contains}'")
+    return check
+
+
+def _compile_int(node):
+    minimum = node.get("min")
+    maximum = node.get("max")
+
+    def check(value, path):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValidationError(f"{_describe(path)} must be an integer")
+        if minimum is not None and value < minimum:
+            raise ValidationError(f"{_describe(path)} must be at least {minimum}")
+        if maximum is not None and value > maximum:
+            raise ValidationError(f"{_describe(path)} must be at most {maximum}")
+    return check
+
+
+def _compile_bool(node):
+    def check(value, path):
+        if not isinstance(value, bool):
+            raise ValidationError(f"{_describe(path)} must be a boolean")
+    return check
+
+
+def _compile_number(node):
+    def check(value, path):
+        if isinstance(value, bool):
+            raise ValidationError(f"{_describe(path)} must be a number")
+        if isinstance(value, int):
+            return
+        if isinstance(value, float) and math.isfinite(value):
+            return
+        if isinstance(value, str):
+            try:
+                if math.isfinite(float(value)):
+                    return
+            except ValueError:
+                pass
+        raise ValidationError(f"{_describe(path)} must be a number or numeric string")
+    return check
+
+
+def _compile_integer(node):
+    def check(value, path):
+        if isinstance(value, bool):
+            raise ValidationError(f"{_describe(path)} must be an integer")
+        if isinstance(value, int):
+            return
+        if isinstance(value, str) and value.lstrip("-").isdigit() and value.isascii():
+            return
+        raise ValidationError(f"{_describe(path)} must be an integer or a string of digits")
+    return check
+
+
+def _compile_any(node):
+    def check(value, path):
+        return
+    return check
+
+
+def _compile_list(node):
+    item_check = _compile(node["items"]) if "items" in node else None
+
+    def check(value, path):
+        if not isinstance(value, list):
+            raise ValidationError(f"{_describe(path)} must be a list")
+        if item_check is not None:
+            for index, item in enumerate(value):
+                item_check(item, f"{path}[{index}]")
+    return check
+
+
+def _compile_dict(node):
+    key_checks = [(key, _compile(child)) for key, child in node.get("keys", {}).items()]
+    required = tuple(node.get("required", ()))
+    same_length = tuple(node.get("same_length", ()))
+
+    def check(value, path):
+        if not isinstance(value, dict):
+            raise ValidationError(f"{_describe(path)} must be an object")
+        prefix = f"{path}." if path else ""
+        for key in required:
+            if key not in value:
+                raise ValidationError(f"missing required key {prefix}{key}")
+        for key, key_check in key_checks:
+            if key in value:
+                key_check(value[key], f"{prefix}{key}")
+        lengths = {len(value[key]) for key in same_length if key in value}
+        if len(lengths) > 1:
+            keys = ", ".join(prefix + key for key in same_length)
+            raise ValidationError(f"{keys} must have the same length")
+    return check
+
+
+_COMPILERS = {
+    "str": _compile_str,
+    "int": _compile_int,
+    "bool": _compile_bool,
+    "number": _compile_number,
+    "integer": _compile_integer,
+    "any": _compile_any,
+    "list": _compile_list,
+    "dict": _compile_dict,
+}
+
+
+def _compile(node):
+    """Turns a schema node into a function that checks a value in one pass."""
+    return _COMPILERS[node["type"]](node)
+
+
+#=========================================#
+#=======     Endpoint Schemas       ======#
+#=========================================#
+
+_STRING = {"type": "str"}
+_KEY_STRING = {"type": "str", "nonempty": True}
+_PROJECT_KEY = {"project_name": _KEY_STRING, "created_at": _KEY_STRING}
+
+# modify_project copies each exposure's count into 'remaining'.
+_EXPOSURE = {
+    "type": "dict",
+    "required": ["count"],
+    "keys": {
+        "count": {"type": "integer"},
+        "exposure": {"type": "number"},
+    },
+}
+
+_PROJECT_EVENT = {
+    "type": "dict",
+    "required": ["project_name", "created_at", "event_id"],
+    "keys": {**_PROJECT_KEY, "event_id": _KEY_STRING},
+}
+
+# Keys shared by a new project and the changes applied to an existing one.
+_PROJECT_DETAILS = {
+    "project_constraints": {"type": "dict"},
+    "project_note": _STRING,
+    "project_targets": {"type": "list", "items": {"type": "dict"}},
+    "project_sites": {"type": "list", "items": _STRING},
+    "scheduled_with_events": {"type": "list", "items": _STRING},
+    "exposures": {"type": "list", "items": _EXPOSURE},
+    "remaining": {"type": "list", "items": {"type": "integer"}},
+    "project_data": {"type": "list", "items": {"type": "list", "items": _STRING}},
+}
+
+SCHEMAS = {
+    "new_project": {
+        "type": "dict",
+        "required": ["project_name", "user_id", "created_at"],
+        "keys": {**_PROJECT_KEY, "user_id": _KEY_STRING, **_PROJECT_DETAILS},
+        # Frames are recorded by index into all three lists.
+        "same_length": ["exposures", "remaining", "project_data"],
+    },
+    "modify_project": {
+        "type": "dict",
+        "required": ["project_name", "created_at", "project_changes"],
+        "keys": {
+            **_PROJECT_KEY,
+            "project_changes": {
+                "type": "dict",
+                # scheduled_with_events is accepted but ignored, since links
+                # only change through the project event endpoints.
+                "required": [
+                    "project_name", "project_constraints", "project_note",
+                    "project_targets", "project_sites", "project_priority",
+                    "exposures",
+                ],
+                "keys": {"project_name": _KEY_STRING, **_PROJECT_DETAILS},
+            },
+        },
+    },
+    "get_project": {
+        "type": "dict",
+        "required": ["project_name", "created_at"],
+        "keys": _PROJECT_KEY,
+    },
+    "get_user_projects": {
+        "type": "dict",
+        "required": ["user_id"],
+        "keys": {"user_id": _KEY_STRING},
+    },
+    "add_project_data": {
+        "type": "dict",
+        "required": ["project_name", "created_at", "exposure_index", "base_filename"],
+        "keys": {
+            **_PROJECT_KEY,
+            "exposure_index": {"type": "int", "min": 0},
+            "base_filename": _KEY_STRING,
+        },
+    },
+    "add_project_event": _PROJECT_EVENT,
+    "remove_project_event": _PROJECT_EVENT,
+    "delete_project": {
+        "type": "dict",
+        "required": ["project_name", "created_at"],
+        "keys": _PROJECT_KEY,
+    },
+    "search_projects": {
+        "type": "dict",
+        "required": ["prefix"],
+        "keys": {
+            "prefix": _STRING,
+            "limit": {"type": "int", "min": 1, "max": 100},
+            "page_token": _KEY_STRING,
+        },
+    },
+    "delete_scheduler_projects": {
+        "type": "dict",
+        "keys": {
+            # Each id is formatted {project_name}#{created_at}.
+            "project_ids": {
+                "type": "list",
+                "items": {"type": "str", "nonempty": True, "contains": "#"},
+            },
+        },
+    },
+}
+
+# Compiled once per container.
+_VALIDATORS = {name: _compile(schema) for name, schema in SCHEMAS.items()}
+
+
+def validate_body(schema_name, body):
+    """Checks an already parsed request body against an endpoint schema.
+
+    Args:
+        schema_name (str): Key of the endpoint schema in SCHEMAS.
+        body: Parsed JSON request body.
+
+    Raises:
+        ValidationError: if the body does not match the schema.
+    """
+    _VALIDATORS[schema_name](body, "")
+
+
+def validate_request(event, schema_name):
+    """Parses and validates the JSON body of an API Gateway event.
+
+    Args:
+        event (dict): Lambda proxy event from API Gateway.
+        schema_name (str): Key of the endpoint schema in SCHEMAS.
+
+    Returns:
+        dict: the parsed request body.
+
+    Raises:
+        ValidationError: if the body is not valid JSON or fails the schema.
+    """
+    raw_body = event.get("body") or "{}"
+    try:
+        # API Gateway base64 encodes request bodies whose content type
+        # matches the binaryMediaTypes configured for the API.
+        if event.get("isBase64Encoded"):
+            raw_body = base64.b64decode(raw_body)
+        body = json.loads(raw_body)
+    except (TypeError, ValueError):
+        raise ValidationError("request body must be valid JSON")
+    validate_body(schema_name, body)
+    return body